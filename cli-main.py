@@ -1,15 +1,63 @@
 import argparse
+import pandas as pd
 from prompt_toolkit.shortcuts import checkboxlist_dialog, radiolist_dialog, yes_no_dialog
-from tts_cli.sql_queries import query_dataframe_for_all_quests_and_gossip, query_dataframe_for_area
-from tts_cli.tts_utils import TTSProcessor
-from tts_cli.init_db import download_and_extract_latest_db_dump, import_sql_files_to_database
+from tts_cli.sql_queries import query_dataframe_for_all_quests_and_gossip, query_dataframe_for_area, connection_pool
+from tts_cli.tts_utils import TTSProcessor, tts_locales, get_output_folder, get_sound_output_folder, DEFAULT_LOCALE
+from tts_cli.lookup_simulator import simulate_lookups
+from tts_cli.init_db import import_expansions, DEFAULT_BULK_BATCH_SIZE
+from tts_cli.snapshot import snapshot_database, restore_database, SNAPSHOT_DIR, DEFAULT_RESTORE_JOBS
 from tts_cli.consts import RACE_DICT_INV, GENDER_DICT_INV, race_gender_tuple_to_strings
 from tts_cli.wrath_model_extraction import write_model_data
-from tts_cli.zone_selector import KalimdorZoneSelector, EasternKingdomsZoneSelector
+from tts_cli.zone_table import write_zone_table, find_zone, parse_bbox, ZONE_TABLE_PATH
+from tts_cli.import_budget import check_import_budget, IMPORT_BUDGET_SECONDS
+from tts_cli.metrics import metrics
+from tts_cli.profiling import start_profiling, stop_profiling, PROFILE_DIR
+from tts_cli.sharding import parse_shard, select_shard, write_shard_manifests, merge_shards
+from tts_cli.audio_postprocess import postprocess_sound_folder, postprocess_totals, TARGET_LUFS
+from tts_cli.server import serve, SERVE_HOST, SERVE_PORT
+from tts_cli.env_vars import METRICS_FOLDER
 from tts_cli import utils
 
 
-def prompt_user(tts_processor):
+def filter_to_area(df, area_df):
+    # the area query is not localized, it only selects which creatures' lines of the localized dataframe are kept
+    return df[(df['type'] == 'creature') & df['id'].isin(area_df['id'])]
+
+
+def get_area(args):
+    if args.zone and args.bbox:
+        raise Exception("--zone and --bbox cannot be combined")
+    if args.zone:
+        return find_zone(args.zone)
+    if args.bbox:
+        return parse_bbox(args.bbox)
+    return None
+
+
+def parse_locales(value):
+    locales = [locale.strip() for locale in value.split(",") if locale.strip()]
+    for locale in locales:
+        # fails on unsupported locales before anything is queried
+        utils.language_code_to_language_number(locale)
+    return list(dict.fromkeys(locales))
+
+
+def query_locales(locales, area_df=None):
+    """Preprocessed lines of every locale in one dataframe, tagged with their locale in the 'locale' column."""
+    frames = []
+    for locale in locales:
+        language_number = utils.language_code_to_language_number(locale)
+        print(f"Selected language: {locale}")
+
+        df = query_dataframe_for_all_quests_and_gossip(language_number)
+        if area_df is not None:
+            df = filter_to_area(df, area_df)
+        df = TTSProcessor(locale).preprocess_dataframe(df)
+        frames.append(df.assign(locale=locale))
+    return pd.concat(frames, ignore_index=True)
+
+
+def prompt_user(locales, area=None):
 
     # map
     map_choices = [
@@ -17,52 +65,49 @@ def prompt_user(tts_processor):
         (0, "Eastern Kingdoms"),
         (1, "Kalimdor"),
     ]
-    map_id = radiolist_dialog(
-        title="Select a map",
-        text="Choose a map:",
-        values=map_choices,
-    ).run()
+    if area is not None:
+        (xrange, yrange, map_id) = area
+        map_name = dict(map_choices).get(map_id, f"Map {map_id}")
+        area_df = query_dataframe_for_area(xrange, yrange, map_id)
+    else:
+        map_id = radiolist_dialog(
+            title="Select a map",
+            text="Choose a map:",
+            values=map_choices,
+        ).run()
+        map_name = map_choices[map_id + 1][1]
 
-    if map_id >= 0:
-        if map_id == 0:
-            zone_selector = EasternKingdomsZoneSelector()
-        else:
-            zone_selector = KalimdorZoneSelector()
+        if map_id >= 0:
+            # matplotlib is only needed to draw the zone by hand
+            from tts_cli.zone_selector import KalimdorZoneSelector, EasternKingdomsZoneSelector
+            if map_id == 0:
+                zone_selector = EasternKingdomsZoneSelector()
+            else:
+                zone_selector = KalimdorZoneSelector()
 
-        # area
-        (xrange, yrange) = zone_selector.select_zone()
+            # area
+            (xrange, yrange) = zone_selector.select_zone()
 
-        df = query_dataframe_for_area(xrange, yrange, map_id)
-    else:
-        (xrange, yrange) = 'all', 'all'
-        df = query_dataframe_for_all_quests_and_gossip()
+            area_df = query_dataframe_for_area(xrange, yrange, map_id)
+        else:
+            (xrange, yrange) = 'all', 'all'
+            area_df = None
 
-    # Get unique race-gender combinations
-    unique_race_gender_combos = df[[
-        'DisplayRaceID', 'DisplaySexID']].drop_duplicates().values
-    # Convert the unique race-gender combinations to a tuple
-    race_gender_tuple = tuple(map(tuple, unique_race_gender_combos))
+    df = query_locales(locales, area_df)
 
     # text estimate
     # Calculate the total amount of characters of non-progress and unique text
-    # TODO: International: Include language parsing here
-    language_code = 'frFR'
-    language_number = utils.language_code_to_language_number(language_code)
-    print(f"Selected language: {language_code}")
-
-    df = query_dataframe_for_all_quests_and_gossip(language_number)
-
-    estimate_df = tts_processor.preprocess_dataframe(df)
-    estimate_df = estimate_df.loc[~estimate_df['source'].str.contains(
+    estimate_df = df.loc[~df['source'].str.contains(
         'progress')]
-    estimate_df = estimate_df[['text', 'DisplayRaceID',
+    estimate_df = estimate_df[['locale', 'text', 'DisplayRaceID',
                                'DisplaySexID']].drop_duplicates()
     total_characters = estimate_df['text'].str.len().sum()
 
     confirmed = yes_no_dialog(
         title="Summary",
-        text=f"Selected Map: {map_choices[map_id][1]}\n"
+        text=f"Selected Map: {map_name}\n"
              f"Coordinate Range: x={xrange}, y={yrange}\n"
+             f"Languages: {', '.join(locales)}\n"
              f"Approximate Text Characters: {total_characters}",
         yes_text='Generate',
         no_text='Cancel'
@@ -74,16 +119,16 @@ def prompt_user(tts_processor):
     return df
 
 
-def prepare_generator():
+def prepare_generator(locales, area=None):
+    area_df = None
+    if area is not None:
+        (xrange, yrange, map_id) = area
+        area_df = query_dataframe_for_area(xrange, yrange, map_id)
 
-    # map
-    df = query_dataframe_for_all_quests_and_gossip()
-
-    language_code = 'frFR'
-    language_number = utils.language_code_to_language_number(language_code)
-    print(f"Selected language: {language_code}")
+    df = query_locales(locales, area_df)
 
-    df = query_dataframe_for_all_quests_and_gossip(language_number)
+    if area is not None:
+        print(f"Selected area: map {map_id}, x={xrange}, y={yrange} ({len(df)} lines)")
 
     return df
 
@@ -91,52 +136,144 @@ def prepare_generator():
 parser = argparse.ArgumentParser(
     description="Text-to-Speech CLI for WoW dialog")
 
+parser.add_argument("--profile", action="store_true",
+                    help="Run the mode under cProfile (torch.profiler for the first syntheses) and write per-thread "
+                         "profiles with a merged per-stage report")
+parser.add_argument("--profile-dir", default=PROFILE_DIR)
 subparsers = parser.add_subparsers(dest="mode", help="Available modes")
-subparsers.add_parser("init-db", help="Initialize the database")
-subparsers.add_parser("interactive", help="Interactive mode")
-subparsers.add_parser("generator", help="Generator mode")
-subparsers.add_parser("extract_model_data", help="Generate info about which NPC entry uses which model.")
+init_db_parser = subparsers.add_parser("init-db", help="Initialize the database")
+init_db_parser.add_argument("--source",
+                            help="Directory with an extracted dump, local zip file, file:// or http(s) URL to import "
+                                 "instead of the latest release")
+init_db_parser.add_argument("--bulk", action="store_true",
+                            help="Import in large transactions with unique and foreign key checks disabled")
+init_db_parser.add_argument("--jobs", type=int, default=1,
+                            help="Number of MySQL connections per expansion to import independent tables concurrently")
+init_db_parser.add_argument("--batch-size", type=int, default=DEFAULT_BULK_BATCH_SIZE,
+                            help="Statements per transaction in bulk import mode")
+init_db_parser.add_argument("--expansion", default="vanilla",
+                            help="Comma separated expansions to import concurrently, each into its own schema: "
+                                 "vanilla (mangos), tbc (mangos_tbc), wotlk (mangos_wrath)")
+init_db_parser.add_argument("--all-tables", action="store_true",
+                            help="Import every table of the dump instead of only those the queries read")
+snapshot_parser = subparsers.add_parser("snapshot", help="Export the tables the generator reads to compressed Parquet files with a manifest")
+snapshot_parser.add_argument("--output", default=SNAPSHOT_DIR)
+restore_parser = subparsers.add_parser("restore", help="Load a snapshot into the configured database backend")
+restore_parser.add_argument("--input", default=SNAPSHOT_DIR)
+restore_parser.add_argument("--jobs", type=int, default=DEFAULT_RESTORE_JOBS,
+                            help="Number of tables restored concurrently")
+for mode, mode_help in [("interactive", "Interactive mode"), ("generator", "Generator mode")]:
+    mode_parser = subparsers.add_parser(mode, help=mode_help)
+    mode_parser.add_argument("--zone",
+                             help=f"Only generate the lines of creatures in this zone or area of {ZONE_TABLE_PATH}, "
+                                  "e.g. \"Elwynn Forest\"")
+    mode_parser.add_argument("--bbox", help="Only generate the lines of creatures in map,x_min,x_max,y_min,y_max "
+                                            "(game coordinates)")
+    mode_parser.add_argument("--lang", default=DEFAULT_LOCALE,
+                             help="Comma separated client locales generated in a single pass, e.g. frFR,deDE,esES")
+    mode_parser.add_argument("--shard",
+                             help="Only generate slice i of N (i/N, e.g. 2/3) of the lines, partitioned by their sound "
+                                  "file, and write this node's manifest for merge")
+subparsers.add_parser("check_import_budget", help="Check that starting the CLI loads no TTS/torch/matplotlib module and stays within an import time budget") \
+          .add_argument("--budget", type=float, default=IMPORT_BUDGET_SECONDS, help="Seconds")
+subparsers.add_parser("gen_zone_table", help="Precompute the bounds of every zone and area from the database for --zone") \
+          .add_argument("--output", default=ZONE_TABLE_PATH)
+subparsers.add_parser("extract_model_data", help="Generate info about which NPC entry uses which model.") \
+          .add_argument("--compare", action="store_true",
+                        help="Also run the old per-row classifier and print timings and the rows it classifies differently")
+postprocess_parser = subparsers.add_parser("postprocess_audio", help="Trim the silence, cap the pauses and normalize the loudness of already generated sounds, then record their new lengths for gen_lookup_tables")
+postprocess_parser.add_argument("--lang", default=DEFAULT_LOCALE, help="Comma separated client locales")
+postprocess_parser.add_argument("--target-lufs", type=float, default=TARGET_LUFS)
+postprocess_parser.add_argument("--jobs", type=int, default=None, help="Worker threads")
+postprocess_parser.add_argument("--dry-run", action="store_true", help="Only report what would be removed")
+serve_parser = subparsers.add_parser("serve", help="Keep the models and voice latents loaded and synthesize lines submitted over a local HTTP API, see README")
+serve_parser.add_argument("--lang", default=DEFAULT_LOCALE, help="Comma separated client locales")
+serve_parser.add_argument("--host", default=SERVE_HOST)
+serve_parser.add_argument("--port", type=int, default=SERVE_PORT)
+subparsers.add_parser("merge", help="Check that the sounds and manifests copied from every --shard node add up to the whole corpus, then rebuild the sound length table and lookup tables") \
+          .add_argument("--lang", default=DEFAULT_LOCALE, help="Comma separated client locales")
 subparsers.add_parser("gen_lookup_tables", help="Generate the lookup tables for all quests and gossip in the game. Also recomputes the sound length table.") \
-          .add_argument("--lang", default="frFR")
+          .add_argument("--lang", default=DEFAULT_LOCALE, help="Comma separated client locales")
+subparsers.add_parser("simulate_lookups", help="Replay all quests and gossip through the addon's lookup logic against the generated lookup tables and report mis-resolutions and lookup cost.") \
+          .add_argument("--lang", default=DEFAULT_LOCALE, help="Comma separated client locales")
 
 args = parser.parse_args()
 
+if args.mode in ("interactive", "generator", "gen_lookup_tables", "serve"):
+    metrics.start(METRICS_FOLDER, args.mode)
+if args.profile:
+    start_profiling(args.profile_dir, args.mode)
+
+
+def generate(locales, df, shard=None):
+    processors = {locale: TTSProcessor(locale) for locale in locales}
+    if shard is None:
+        tts_locales(processors, df)
+    else:
+        tts_locales(processors, select_shard(df, shard))
+        write_shard_manifests(processors, df, shard)
+
 
 def interactive_mode():
-    tts_processor = TTSProcessor()
-    df = prompt_user(tts_processor)
-    df = tts_processor.preprocess_dataframe(df)
-    tts_processor.tts_dataframe(df)
+    locales = parse_locales(args.lang)
+    shard = parse_shard(args.shard) if args.shard else None
+    df = prompt_user(locales, get_area(args))
+    generate(locales, df, shard)
 
 
 def generator_mode():
-    tts_processor = TTSProcessor()
-    df = prepare_generator()
-    df = tts_processor.preprocess_dataframe(df)
-    tts_processor.tts_dataframe(df)
+    locales = parse_locales(args.lang)
+    shard = parse_shard(args.shard) if args.shard else None
+    df = prepare_generator(locales, get_area(args))
+    generate(locales, df, shard)
 
 
 if args.mode == "init-db":
-    # if args.expansion:
-    #     expansion = args.expansion.lower()
-    # else:
-    #     expansion = "vanilla"
-    download_and_extract_latest_db_dump()
-    import_sql_files_to_database()
+    expansions = [expansion.strip().lower() for expansion in args.expansion.split(",") if expansion.strip()]
+    import_expansions(expansions, source=args.source, bulk=args.bulk, batch_size=args.batch_size, jobs=args.jobs,
+                      all_tables=args.all_tables)
     print("Database initialized successfully.")
+elif args.mode == "snapshot":
+    snapshot_database(args.output)
+elif args.mode == "restore":
+    restore_database(args.input, args.jobs)
+elif args.mode == "check_import_budget":
+    check_import_budget(__file__, args.budget)
+elif args.mode == "gen_zone_table":
+    write_zone_table(args.output)
 elif args.mode == "interactive":
     interactive_mode()
 elif args.mode == "generator":
     generator_mode()
 elif args.mode == "gen_lookup_tables":
-    tts_processor = TTSProcessor()
-
-    language_code = args.lang
-    language_number = utils.language_code_to_language_number(language_code)
-    print(f"Selected language: {language_code}")
-
-    df = query_dataframe_for_all_quests_and_gossip(language_number)
-    df = tts_processor.preprocess_dataframe(df)
-    tts_processor.generate_lookup_tables(df)
+    df = query_locales(parse_locales(args.lang))
+    for language_code, locale_df in df.groupby('locale', sort=False):
+        TTSProcessor(language_code).generate_lookup_tables(locale_df.drop(columns='locale').reset_index(drop=True))
+elif args.mode == "merge":
+    locales = parse_locales(args.lang)
+    tts_processors = {language_code: TTSProcessor(language_code) for language_code in locales}
+    # checked before anything is queried
+    for tts_processor in tts_processors.values():
+        merge_shards(tts_processor)
+    df = query_locales(locales)
+    for language_code, locale_df in df.groupby('locale', sort=False):
+        tts_processors[language_code].generate_lookup_tables(locale_df.drop(columns='locale').reset_index(drop=True))
+elif args.mode == "simulate_lookups":
+    df = query_locales(parse_locales(args.lang))
+    for language_code, locale_df in df.groupby('locale', sort=False):
+        simulate_lookups(locale_df.drop(columns='locale').reset_index(drop=True),
+                         get_output_folder(language_code))
+elif args.mode == "postprocess_audio":
+    for language_code in parse_locales(args.lang):
+        postprocess_sound_folder(get_sound_output_folder(language_code), args.target_lufs, args.dry_run, args.jobs)
+elif args.mode == "serve":
+    serve(parse_locales(args.lang), query_locales, args.host, args.port)
 elif args.mode == "extract_model_data":
-    write_model_data()
+    write_model_data(args.compare)
+
+stop_profiling()
+postprocess_totals.print_report()
+metrics.print_report()
+metrics.close()
+connection_pool.print_report()
+connection_pool.close()
@@ -0,0 +1,261 @@
+import io
+import os
+import wave
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tts_cli.length_table import SOUND_FILE_EXTENSIONS, record_sound_lengths
+
+# frames quieter than this, relative to the loudest frame of the clip, are silence
+SILENCE_THRESHOLD_DB = -40.0
+SILENCE_FRAME_SECONDS = 0.01
+# silence kept before the first and after the last spoken frame, so words are not clipped
+TRIM_PADDING_SECONDS = 0.05
+# XTTS pads every sentence with its own silence on top of the 10000 samples the synthesizer adds between sentences
+MAX_GAP_SECONDS = 0.35
+TARGET_LUFS = -18.0
+PEAK_CEILING_DBFS = -1.0
+POSTPROCESS_BATCH_SIZE = 32
+SAMPLE_WIDTH = 2
+UNCHANGED_GAIN_DB = 0.1
+
+# ITU-R BS.1770-4 integrated loudness
+LOUDNESS_BLOCK_SECONDS = 0.4
+LOUDNESS_BLOCK_STEP_SECONDS = 0.1
+LOUDNESS_ABSOLUTE_GATE = -70.0
+LOUDNESS_RELATIVE_GATE = -10.0
+
+
+def get_k_weighting_response(sample_rate, length):
+    """
+    Magnitude of the BS.1770 K-weighting filter (high shelf then high pass) at the rfft bins of a signal of length
+    samples. The biquads are derived for any sample rate so they match the coefficients the standard gives at 48kHz.
+    """
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    shelf_b = [vh + vb * k / q + k * k, 2 * (k * k - vh), vh - vb * k / q + k * k]
+    shelf_a = [1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k]
+
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    high_pass_b = [1.0, -2.0, 1.0]
+    high_pass_a = [1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k]
+
+    z = np.exp(-1j * np.pi * np.fft.rfftfreq(length) * 2)
+    response = np.ones(len(z))
+    for b, a in [(shelf_b, shelf_a), (high_pass_b, high_pass_a)]:
+        response *= np.abs((b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z))
+    return response
+
+
+def get_integrated_loudness(samples, sample_rate):
+    """
+    Gated loudness of a mono clip in LUFS, or None for silence. The K-weighting is applied in the frequency domain:
+    only the power of the weighted signal matters here, and it is the same as with the causal filters.
+    """
+    if not len(samples):
+        return None
+    # padded so the circular convolution does not wrap the end of the clip onto its start
+    length = len(samples) + int(sample_rate * 0.1)
+    weighted = np.fft.irfft(np.fft.rfft(samples, length) * get_k_weighting_response(sample_rate, length),
+                            length)[:len(samples)]
+
+    block = min(int(LOUDNESS_BLOCK_SECONDS * sample_rate), len(samples))
+    step = max(int(LOUDNESS_BLOCK_STEP_SECONDS * sample_rate), 1)
+    energy = np.concatenate([[0.0], np.cumsum(weighted.astype(np.float64) ** 2)])
+    starts = np.arange(0, len(samples) - block + 1, step)
+    power = (energy[starts + block] - energy[starts]) / block
+
+    with np.errstate(divide='ignore'):
+        block_loudness = -0.691 + 10 * np.log10(power)
+    power = power[block_loudness > LOUDNESS_ABSOLUTE_GATE]
+    if not len(power):
+        return None
+    relative_gate = -0.691 + 10 * np.log10(power.mean()) + LOUDNESS_RELATIVE_GATE
+    power = power[-0.691 + 10 * np.log10(power) > relative_gate]
+    return float(-0.691 + 10 * np.log10(power.mean()))
+
+
+def get_silent_frames(samples, sample_rate):
+    frame = max(int(SILENCE_FRAME_SECONDS * sample_rate), 1)
+    frames = len(samples) // frame
+    if not frames:
+        return np.ones(0, dtype=bool), frame
+    rms = np.sqrt(np.mean(samples[:frames * frame].reshape(frames, frame).astype(np.float64) ** 2, axis=1))
+    if rms.max() == 0:
+        return np.ones(frames, dtype=bool), frame
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(rms / rms.max()) < SILENCE_THRESHOLD_DB, frame
+
+
+def trim_silence(samples, sample_rate):
+    silent, frame = get_silent_frames(samples, sample_rate)
+    spoken = np.flatnonzero(~silent)
+    if not len(spoken):
+        return samples
+    padding = int(TRIM_PADDING_SECONDS * sample_rate)
+    start = max(spoken[0] * frame - padding, 0)
+    end = min((spoken[-1] + 1) * frame + padding, len(samples))
+    return samples[start:end]
+
+
+def cap_silence_gaps(samples, sample_rate):
+    """Shortens every silence between two spoken frames to MAX_GAP_SECONDS, cutting out its middle."""
+    silent, frame = get_silent_frames(samples, sample_rate)
+    edges = np.diff(np.concatenate([[0], silent.astype(np.int8), [0]]))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    # silence at the very start or end is trim_silence's business
+    interior = (run_starts > 0) & (run_ends < len(silent))
+    keep = int(MAX_GAP_SECONDS * sample_rate) // 2
+    cut_starts = run_starts[interior] * frame + keep
+    cut_ends = run_ends[interior] * frame - keep
+    long_gaps = cut_ends > cut_starts
+    if not long_gaps.any():
+        return samples
+
+    cuts = np.zeros(len(samples) + 1, dtype=np.int32)
+    np.add.at(cuts, cut_starts[long_gaps], 1)
+    np.add.at(cuts, cut_ends[long_gaps], -1)
+    return samples[np.cumsum(cuts[:-1]) == 0]
+
+
+def normalize_loudness(samples, sample_rate, target_lufs=TARGET_LUFS):
+    """Returns the clip at target_lufs, or quieter if that would push its peak over PEAK_CEILING_DBFS."""
+    loudness = get_integrated_loudness(samples, sample_rate)
+    if loudness is None:
+        return samples, None, 0.0
+    gain_db = target_lufs - loudness
+    peak = np.abs(samples).max()
+    gain_db = min(gain_db, PEAK_CEILING_DBFS - 20 * np.log10(peak))
+    return samples * np.float32(10 ** (gain_db / 20)), loudness, float(gain_db)
+
+
+def postprocess(samples, sample_rate, target_lufs=TARGET_LUFS):
+    """Trims the silence around the clip, caps the pauses between sentences and normalizes its loudness."""
+    samples = np.asarray(samples, dtype=np.float32)
+    trimmed = trim_silence(samples, sample_rate)
+    capped = cap_silence_gaps(trimmed, sample_rate)
+    normalized, loudness, gain_db = normalize_loudness(capped, sample_rate, target_lufs)
+    stats = {
+        'input_seconds': len(samples) / sample_rate,
+        'output_seconds': len(normalized) / sample_rate,
+        'trimmed_seconds': (len(samples) - len(trimmed)) / sample_rate,
+        'gap_seconds': (len(trimmed) - len(capped)) / sample_rate,
+        'bytes_removed': (len(samples) - len(normalized)) * SAMPLE_WIDTH,
+        'loudness': loudness,
+        'gain_db': gain_db,
+    }
+    return normalized, stats
+
+
+def encode_wav(samples, sample_rate):
+    """16-bit mono WAV, without the peak normalization TTS' save_wav applies, which would undo the loudness one."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(SAMPLE_WIDTH)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+    return buffer
+
+
+def read_wav(path):
+    """Returns (float samples, sample rate) of a 16-bit mono WAV file, or None for anything else."""
+    try:
+        with wave.open(path, 'rb') as f:
+            if f.getnchannels() != 1 or f.getsampwidth() != SAMPLE_WIDTH:
+                return None
+            sample_rate = f.getframerate()
+            pcm = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+    except (wave.Error, EOFError):
+        return None
+    return pcm.astype(np.float32) / 32767, sample_rate
+
+
+class PostprocessTotals:
+    """Seconds and bytes removed across every clip post-processed by this run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clips = 0
+        self.skipped = 0
+        self.input_seconds = 0.0
+        self.trimmed_seconds = 0.0
+        self.gap_seconds = 0.0
+        self.bytes_removed = 0
+        self.gains = []
+
+    def add(self, stats):
+        with self.lock:
+            self.clips += 1
+            self.input_seconds += stats['input_seconds']
+            self.trimmed_seconds += stats['trimmed_seconds']
+            self.gap_seconds += stats['gap_seconds']
+            self.bytes_removed += stats['bytes_removed']
+            if stats['loudness'] is not None:
+                self.gains.append(stats['gain_db'])
+
+    def print_report(self):
+        if not self.clips and not self.skipped:
+            return
+        removed = self.trimmed_seconds + self.gap_seconds
+        print(f"Post-processed {self.clips} clips ({self.skipped} skipped): removed {removed:.1f}s of "
+              f"{self.input_seconds:.1f}s ({100 * removed / max(self.input_seconds, 1e-9):.1f}%), "
+              f"{self.trimmed_seconds:.1f}s of leading/trailing silence and {self.gap_seconds:.1f}s of long pauses, "
+              f"{self.bytes_removed / 1e6:.1f}MB")
+        if self.gains:
+            print(f"Loudness gain to {TARGET_LUFS} LUFS: median {np.median(self.gains):+.1f}dB, "
+                  f"min {min(self.gains):+.1f}dB, max {max(self.gains):+.1f}dB")
+
+
+postprocess_totals = PostprocessTotals()
+
+
+def postprocess_file(path, target_lufs=TARGET_LUFS, dry_run=False):
+    """Post-processes a generated clip in place, returns (new length in seconds, new size) or None if skipped."""
+    audio = read_wav(path)
+    if audio is None:
+        with postprocess_totals.lock:
+            postprocess_totals.skipped += 1
+        return None
+    samples, stats = postprocess(*audio, target_lufs)
+    postprocess_totals.add(stats)
+    # already post-processed clips come back unchanged, up to rounding
+    if dry_run or (not stats['bytes_removed'] and abs(stats['gain_db']) < UNCHANGED_GAIN_DB):
+        return None
+
+    buffer = encode_wav(samples, audio[1])
+    with open(path + ".part", "wb") as f:
+        f.write(buffer.getbuffer())
+    os.replace(path + ".part", path)
+    return stats['output_seconds'], buffer.getbuffer().nbytes
+
+
+def postprocess_files(paths, target_lufs=TARGET_LUFS, dry_run=False, max_workers=None):
+    """
+    Post-processes already generated clips in place, POSTPROCESS_BATCH_SIZE files per task so the pool is not
+    dominated by scheduling; numpy releases the GIL in the heavy parts. Returns {path: (length, size)} of the files
+    rewritten.
+    """
+    def process_batch(batch):
+        return [(path, postprocess_file(path, target_lufs, dry_run)) for path in batch]
+
+    batches = [paths[i:i + POSTPROCESS_BATCH_SIZE] for i in range(0, len(paths), POSTPROCESS_BATCH_SIZE)]
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch in executor.map(process_batch, batches):
+            results.update((path, result) for path, result in batch if result is not None)
+    return results
+
+
+def postprocess_sound_folder(sound_folder_path, target_lufs=TARGET_LUFS, dry_run=False, max_workers=None):
+    """Post-processes every clip generated before this stage existed and records their new lengths."""
+    paths = sorted(os.path.join(root, f) for root, dirs, files in os.walk(sound_folder_path)
+                   for f in files if f.endswith(SOUND_FILE_EXTENSIONS))
+    print(f"{len(paths)} sound files in {sound_folder_path}" + (", dry run" if dry_run else ""))
+    results = postprocess_files(paths, target_lufs, dry_run, max_workers)
+    record_sound_lengths(sound_folder_path, [(path, length, size) for path, (length, size) in sorted(results.items())])
@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+POOL_MAX_SIZE = 4
+# idle connections older than this are pinged before being handed out again
+POOL_PING_AFTER_SECONDS = 30
+
+
+class ConnectionPool:
+    """
+    Keeps up to max_size open connections made by connect(). Connections are checked out with
+    `with pool.connection() as db:` and go back to the pool afterwards, unless the block raised, in which case
+    the connection is closed since its state is unknown. ping(db) raises if a connection went stale.
+    """
+
+    def __init__(self, connect, ping, max_size=POOL_MAX_SIZE):
+        self.connect = connect
+        self.ping = ping
+        self.max_size = max_size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.connections_opened = 0
+        self.stale_connections = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def get_healthy_connection(self):
+        while True:
+            try:
+                db, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                db = self.connect()
+                with self.stats_lock:
+                    self.connections_opened += 1
+                return db
+
+            if time.monotonic() - last_used < POOL_PING_AFTER_SECONDS:
+                return db
+            try:
+                self.ping(db)
+                return db
+            except Exception:
+                with self.stats_lock:
+                    self.stale_connections += 1
+                close_quietly(db)
+
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        self.slots.acquire()
+        try:
+            db = self.get_healthy_connection()
+        except BaseException:
+            self.slots.release()
+            raise
+
+        wait = time.perf_counter() - start
+        with self.stats_lock:
+            self.checkouts += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+        try:
+            yield db
+        except BaseException:
+            close_quietly(db)
+            raise
+        else:
+            self.idle.put((db, time.monotonic()))
+        finally:
+            self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                db, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            close_quietly(db)
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {
+                'checkouts': self.checkouts,
+                'connections_opened': self.connections_opened,
+                'stale_connections': self.stale_connections,
+                'idle_connections': self.idle.qsize(),
+                'wait_seconds': round(self.wait_seconds, 6),
+                'max_wait_seconds': round(self.max_wait_seconds, 6),
+            }
+
+    def print_report(self):
+        if not self.checkouts:
+            return
+        print(f"Connection pool: {self.checkouts} checkouts over {self.connections_opened} connections "
+              f"({self.stale_connections} stale replaced), waited {self.wait_seconds * 1000:.1f}ms in total, "
+              f"{self.max_wait_seconds * 1000:.1f}ms at most")
+
+
+def close_quietly(db):
+    try:
+        db.close()
+    except Exception:
+        pass
@@ -3,8 +3,13 @@ load_dotenv()
 import os
 
 MYSQL_HOST = os.getenv("MYSQL_HOST")
-MYSQL_PORT = int(os.getenv("MYSQL_PORT"))
+MYSQL_PORT = int(os.getenv("MYSQL_PORT", "3306"))
 MYSQL_USER = os.getenv("MYSQL_USER")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
 MYSQL_DATABASE = os.getenv("MYSQL_DATABASE")
+# "mysql" (default) or "sqlite" for the embedded database imported by init-db into SQLITE_FOLDER
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql").lower()
+SQLITE_FOLDER = os.getenv("SQLITE_FOLDER", "assets/sql/sqlite")
 ELEVENLABS_API_KEY = os.getenv('ELEVENLABS_API_KEY')
+# generator, interactive and gen_lookup_tables write their JSON lines and Prometheus metrics here
+METRICS_FOLDER = os.getenv("METRICS_FOLDER", "metrics")
@@ -0,0 +1,38 @@
+import re
+
+# Lua's %S+ only treats ASCII whitespace as separators, unlike Python's \S
+LUA_WORD_PATTERN = re.compile(r'[^ \t\n\r\f\v]+')
+
+
+def tokenize(text):
+    return set(LUA_WORD_PATTERN.findall(text))
+
+
+# Mirrors jaccardSimilarity in AI_VoiceOver/FuzzySearch.lua, on pre-tokenized sets
+def jaccard_similarity(tokens_a, tokens_b):
+    union = len(tokens_a | tokens_b)
+    if union == 0:
+        return float('nan')  # 0 / 0 in Lua
+    return len(tokens_a & tokens_b) / union
+
+
+def fuzzy_search_best_keys(query, table):
+    """
+    Mirrors FuzzySearchBestKeys in AI_VoiceOver/FuzzySearch.lua.
+    Lua iterates with pairs(), so among equally similar entries the winner is unspecified; here it is the first one.
+    """
+    query_tokens = tokenize(query)
+    best_result = None
+    max_similarity = -1
+
+    for entry, value in table.items():
+        similarity = jaccard_similarity(query_tokens, tokenize(entry))
+        if similarity > max_similarity:
+            max_similarity = similarity
+            best_result = {
+                'value': value,
+                'text': entry,
+                'similarity': similarity,
+            }
+
+    return best_result
@@ -0,0 +1,53 @@
+import subprocess
+import sys
+
+# only the synthesis path (tts_ai) and the map picker (zone_selector) may load these
+HEAVY_PACKAGES = ['torch', 'TTS', 'fairseq', 'librosa', 'matplotlib', 'transformers']
+IMPORT_BUDGET_SECONDS = 2.0
+IMPORT_TIME_PREFIX = 'import time:'
+
+
+def measure_imports(command):
+    """
+    Runs command under `python -X importtime` and returns ({top level module: cumulative seconds},
+    set of every module imported).
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', *command], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"{' '.join(command)} failed:\n{result.stderr[-2000:]}")
+
+    top_level = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith(IMPORT_TIME_PREFIX):
+            continue
+        self_us, cumulative_us, name = line[len(IMPORT_TIME_PREFIX):].split('|')
+        if not cumulative_us.strip().isdigit():
+            # header line
+            continue
+        modules.add(name.strip())
+        # nested imports are indented under the module that triggered them
+        if not name.startswith('  '):
+            top_level[name.strip()] = int(cumulative_us) / 1e6
+    return top_level, modules
+
+
+def check_import_budget(script, budget_seconds=IMPORT_BUDGET_SECONDS):
+    """
+    Fails if starting the CLI (everything but synthesis loads at the top of the script) imports a heavy package
+    or takes more than budget_seconds in imports.
+    """
+    top_level, modules = measure_imports([script, '--help'])
+    total = sum(top_level.values())
+
+    print("Slowest imports:")
+    for name, seconds in sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:10]:
+        print(f"  {seconds * 1000:8.1f}ms  {name}")
+    print(f"Total: {total:.2f}s (budget {budget_seconds:.2f}s)")
+
+    loaded = sorted({name.split('.')[0] for name in modules} & set(HEAVY_PACKAGES))
+    if loaded:
+        raise Exception(f"Heavy packages imported at startup: {', '.join(loaded)}")
+    if total > budget_seconds:
+        raise Exception(f"Startup imports took {total:.2f}s, over the {budget_seconds:.2f}s budget")
+    print("Import budget OK")
@@ -1,12 +1,28 @@
-from tts_cli.env_vars import MYSQL_HOST, MYSQL_PORT, MYSQL_PASSWORD, MYSQL_USER, MYSQL_DATABASE
+from tts_cli.env_vars import MYSQL_HOST, MYSQL_PORT, MYSQL_PASSWORD, MYSQL_USER, MYSQL_DATABASE, DB_BACKEND
 import pymysql
-import io
 import zipfile
+import gzip
+import shutil
+import hashlib
+import json
+import urllib.parse
+import urllib.request
 import requests
 import os
 import sys
 import re
+import time
+import zlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+from tts_cli.sql_splitter import iter_sql_statements, get_statement_table, get_query_tables, SqlStatementError, \
+    DEFERRED_STATEMENT, TableAllowList, is_multi_table_statement
+from tts_cli.sql_queries import AREA_QUERY, ALL_QUESTS_AND_GOSSIP_QUERY, LOCALIZED_SELECT, QUEST_GIVER_POSITIONS_QUERY, \
+    AREA_NAMES_QUERY
+from tts_cli.wrath_model_extraction import MODEL_DATA_QUERIES
+from tts_cli.sqlite_backend import import_sql_files_to_sqlite, get_sqlite_path
 
 # vanilla db dump url
 VMANGOS_DB_DUMP_URL = "https://api.github.com/repos/vmangos/core/releases/tags/db_latest"
@@ -26,57 +42,277 @@ TBC_EXPORTED_FILES = ['assets/sql/exported/tbc/CreatureDisplayInfo.sql',
 WOTLK_EXPORTED_FILES = ['assets/sql/exported/wotlk/CreatureDisplayInfo.sql',
                       'assets/sql/exported/wotlk/CreatureDisplayInfoExtra.sql']
 
-def download_and_extract_latest_db_dump():
-    expansion = 'vanilla'
-    print(f"Retrieving latest version for {expansion}")
-    check_version = requests.get(VMANGOS_DB_DUMP_URL)
-    get_latest = check_version.json()['assets'][0]['browser_download_url']
-    response = requests.get(get_latest)
-    if response.status_code == 200:
-        z = zipfile.ZipFile(io.BytesIO(response.content))
-        if(expansion == 'vanilla'):
-            z.extractall("assets/sql")
+# every expansion gets its own schema, write_model_data reads mangos and mangos_wrath side by side
+EXPANSIONS = {
+    'vanilla': {'url': VMANGOS_DB_DUMP_URL, 'schema': MYSQL_DATABASE, 'exported_files': EXPORTED_FILES},
+    'tbc': {'url': TBC_DB_DUMP_URL, 'schema': 'mangos_tbc', 'exported_files': TBC_EXPORTED_FILES},
+    'wotlk': {'url': WOTLK_DB_DUMP_URL, 'schema': 'mangos_wrath', 'exported_files': WOTLK_EXPORTED_FILES},
+}
+
+# statements per transaction in bulk import mode
+DEFAULT_BULK_BATCH_SIZE = 5000
+
+# session settings relaxed during a bulk import, restored afterwards
+BULK_SESSION_SETTINGS = ['autocommit', 'unique_checks', 'foreign_key_checks']
+
+
+# MySQL error codes worth retrying during a parallel import
+TRANSIENT_MYSQL_ERRORS = {1205, 1213}  # lock wait timeout, deadlock
+LOST_CONNECTION_MYSQL_ERRORS = {2006, 2013}  # server has gone away, lost connection during query
+IMPORT_RETRIES = 3
+# statements queued per import worker, and bytes of uncommitted statements a worker keeps to replay after a failure
+IMPORT_QUEUE_SIZE = 256
+IMPORT_BATCH_MAX_BYTES = 64 * 1024 * 1024
+# each import transaction records its worker's commit counter here, so that a worker whose connection dropped during
+# a commit can tell whether the commit landed before replaying its statements
+IMPORT_COMMITS_TABLE = 'import_commit_markers'
+
+# connection-scoped table locks make no sense when a dump is spread over several connections
+TABLE_LOCK_STATEMENT = re.compile(r'^\s*(?:UN)?LOCK\s+TABLES\b', re.IGNORECASE)
+DDL_STATEMENT = re.compile(r'^\s*(?:CREATE|DROP|ALTER|TRUNCATE|RENAME)\b', re.IGNORECASE)
+# applied on every import connection, and again after a reconnect
+SESSION_STATEMENT = re.compile(r'^\s*(?:SET|USE)\b', re.IGNORECASE)
+
+# everything the generator reads, the import allow-list is derived from these
+QUERIES = [AREA_QUERY, ALL_QUESTS_AND_GOSSIP_QUERY + LOCALIZED_SELECT, QUEST_GIVER_POSITIONS_QUERY, AREA_NAMES_QUERY,
+           *MODEL_DATA_QUERIES.values()]
+
+DB_DUMP_CACHE_DIR = "assets/sql/cache"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+# written next to the extracted dump to skip extraction when the same archive was already unpacked
+EXTRACTED_MARKER = ".extracted.json"
+
+
+def get_file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def read_json(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def remove_partial_download(part_path):
+    for leftover in (part_path, part_path + ".json"):
+        if os.path.isfile(leftover):
+            os.remove(leftover)
+
+
+def download_file(url, path, expected_size=None, expected_sha256=None):
+    """
+    Streams url to path, resuming from path + '.part' when a previous download was interrupted.
+    The partial file is only resumed if the server still serves the same ETag, otherwise it starts over.
+    Returns (etag, sha256) of the downloaded file.
+    """
+    part_path = path + ".part"
+    part_meta_path = part_path + ".json"
+    part_meta = read_json(part_meta_path) or {}
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+
+    headers = {}
+    if offset and part_meta.get('etag'):
+        headers['Range'] = f"bytes={offset}-"
+        headers['If-Range'] = part_meta['etag']
+
+    with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 416 and offset:
+            # a previous run got the whole file but stopped before verifying it, the server has nothing left to send
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            if total.isdigit() and int(total) != offset:
+                print(f"Discarding a partial download of {offset} bytes, the file has {total}")
+                remove_partial_download(part_path)
+                return download_file(url, path, expected_size, expected_sha256)
+            print(f"Partial download already complete ({offset / 1024 ** 2:.1f} MB), verifying it")
+            etag = part_meta['etag']
         else:
-            # logic for extracting mangos databases.
-            # If scraping data, logic should be modified or moved to a separate function
-            z.extractall(f"assets/sql/db_dump/{expansion}")
-        print("Successfully downloaded and extracted database dump.")
-    else:
-        print("Error: Unable to download the database dump.")
-        exit(1)
+            response.raise_for_status()
+            etag = response.headers.get('ETag')
+
+            if response.status_code == 206:
+                print(f"Resuming download at {offset / 1024 ** 2:.1f} MB")
+                mode = "ab"
+            else:
+                offset = 0
+                mode = "wb"
+            write_json(part_meta_path, {'url': url, 'etag': etag})
+
+            total = expected_size or (offset + int(response.headers.get('Content-Length', 0))) or None
+            with open(part_path, mode) as f, \
+                    tqdm(total=total, initial=offset, unit='B', unit_scale=True, desc='Downloading', ncols=100) as pbar:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    pbar.update(len(chunk))
+
+    size = os.path.getsize(part_path)
+    if expected_size is not None and size != expected_size:
+        remove_partial_download(part_path)
+        raise Exception(f"Downloaded {size} bytes from {url}, expected {expected_size}")
+
+    sha256 = get_file_sha256(part_path)
+    if expected_sha256 is not None and sha256 != expected_sha256:
+        remove_partial_download(part_path)
+        raise Exception(f"Checksum mismatch for {url}: got {sha256}, expected {expected_sha256}")
+
+    os.replace(part_path, path)
+    os.remove(part_meta_path)
+    return etag, sha256
+
 
+def get_cached_release_asset(release_url):
+    """
+    Returns the path of the first asset of a GitHub release in DB_DUMP_CACHE_DIR, downloading it first unless a
+    verified copy of the same asset (same asset ID and upload date) is already cached.
+    """
+    release = requests.get(release_url, timeout=60)
+    release.raise_for_status()
+    asset = release.json()['assets'][0]
 
-def count_total_chunks(files, delimiter):
-    total_chunks = 0
-    for file in files:
-        with open(file, "rb") as f:
-            buffer = f.read()
-            total_chunks += buffer.count(delimiter)
-    return total_chunks
+    # GitHub publishes "sha256:<hex>" digests for newer uploads
+    digest = asset.get('digest') or ''
+    expected_sha256 = digest[len('sha256:'):] if digest.startswith('sha256:') else None
 
+    os.makedirs(DB_DUMP_CACHE_DIR, exist_ok=True)
+    asset_path = os.path.join(DB_DUMP_CACHE_DIR, f"{asset['id']}-{asset['name']}")
+    meta_path = asset_path + ".json"
 
-def count_commands_from_file(filename):
-    fd = open(filename, 'r')
-    sqlFile = fd.read()
-    fd.close()
+    meta = read_json(meta_path)
+    if meta and meta['updated_at'] == asset['updated_at'] and os.path.isfile(asset_path) \
+            and os.path.getsize(asset_path) == asset['size'] \
+            and get_file_sha256(asset_path) == (expected_sha256 or meta['sha256']):
+        print(f"Using cached {asset['name']} (asset {asset['id']}, ETag {meta['etag']})")
+        return asset_path
 
-    sqlCommands = sqlFile.split(';')
-    return len(sqlCommands)
+    print(f"Downloading {asset['name']} ({asset['size'] / 1024 ** 2:.1f} MB)")
+    etag, sha256 = download_file(asset['browser_download_url'], asset_path, asset['size'], expected_sha256)
+    write_json(meta_path, {
+        'asset_id': asset['id'],
+        'name': asset['name'],
+        'updated_at': asset['updated_at'],
+        'size': asset['size'],
+        'etag': etag,
+        'sha256': sha256,
+    })
+    return asset_path
 
 
-def execute_scripts_from_file(cursor, filename, progress_update_fn):
-    fd = open(filename, 'r')
-    sqlFile = fd.read()
-    fd.close()
+def get_cached_url(url):
+    os.makedirs(DB_DUMP_CACHE_DIR, exist_ok=True)
+    path = os.path.join(DB_DUMP_CACHE_DIR, hashlib.sha256(url.encode()).hexdigest()[:16] + "-" +
+                        os.path.basename(urllib.parse.urlparse(url).path))
+    if not os.path.isfile(path):
+        download_file(url, path)
+    return path
 
-    sqlCommands = sqlFile.split(';')
 
-    for command in sqlCommands:
+def extract_archive(archive_path, extract_dir):
+    sha256 = get_file_sha256(archive_path)
+    marker_path = os.path.join(extract_dir, EXTRACTED_MARKER)
+
+    if not zipfile.is_zipfile(archive_path):
+        # some releases ship a single gzipped .sql file
+        output_path = os.path.join(extract_dir, os.path.basename(archive_path).removesuffix('.gz'))
+        marker = read_json(marker_path)
+        if marker and marker['sha256'] == sha256 and os.path.isfile(output_path):
+            print(f"{os.path.basename(archive_path)} is already extracted, skipping extraction")
+            return
+        os.makedirs(extract_dir, exist_ok=True)
+        with gzip.open(archive_path, "rb") as source, open(output_path, "wb") as target:
+            shutil.copyfileobj(source, target, DOWNLOAD_CHUNK_SIZE)
+        write_json(marker_path, {'archive': os.path.basename(archive_path), 'sha256': sha256})
+        return
+
+    with zipfile.ZipFile(archive_path) as z:
+        members = [info for info in z.infolist() if not info.is_dir()]
+        marker = read_json(marker_path)
+        if marker and marker['sha256'] == sha256 and all(
+                os.path.isfile(os.path.join(extract_dir, info.filename))
+                and os.path.getsize(os.path.join(extract_dir, info.filename)) == info.file_size
+                for info in members):
+            print(f"{os.path.basename(archive_path)} is already extracted, skipping extraction")
+            return
+
+        for info in tqdm(members, desc='Extracting', ncols=100):
+            z.extract(info, extract_dir)
+
+    write_json(marker_path, {'archive': os.path.basename(archive_path), 'sha256': sha256})
+
+
+def download_and_extract_latest_db_dump(source=None, expansion='vanilla'):
+    """
+    Fetches the database dump of an expansion and returns the directory holding its .sql files.
+    source can be a directory already holding .sql files, a local zip file or file:// URL (for offline use),
+    or an http(s) URL of a zip file. By default the latest release asset is fetched from GitHub.
+    """
+    if expansion == 'vanilla':
+        extract_dir = "assets/sql"
+        db_dump_dir = "assets/sql/db_dump"
+    else:
+        # logic for extracting mangos databases.
+        # If scraping data, logic should be modified or moved to a separate function
+        extract_dir = db_dump_dir = f"assets/sql/db_dump/{expansion}"
+
+    if source is None:
+        print(f"Retrieving latest version for {expansion}")
+        archive_path = get_cached_release_asset(EXPANSIONS[expansion]['url'])
+    else:
+        parsed = urllib.parse.urlparse(source)
+        if parsed.scheme in ('http', 'https'):
+            archive_path = get_cached_url(source)
+        else:
+            archive_path = urllib.request.url2pathname(parsed.path) if parsed.scheme == 'file' else source
+            if os.path.isdir(archive_path):
+                print(f"Using database dump from {archive_path}")
+                return archive_path
+            if not os.path.isfile(archive_path):
+                print(f"Error: {source} does not exist.")
+                exit(1)
+
+    extract_archive(archive_path, extract_dir)
+    print(f"Successfully downloaded and extracted {expansion} database dump.")
+    return db_dump_dir
+
+
+def find_sql_files(db_dump_dir):
+    sql_files = sorted(os.path.join(db_dump_dir, f) for f in os.listdir(db_dump_dir)
+                       if f.endswith(".sql") and os.path.isfile(os.path.join(db_dump_dir, f)))
+    if sql_files:
+        return sql_files
+    # archives that unpack into a folder of their own
+    return sorted(os.path.join(root, f) for root, _, files in os.walk(db_dump_dir) for f in files if f.endswith(".sql"))
+
+
+def get_queried_tables(db_name):
+    tables = set()
+    for query in QUERIES:
+        tables |= get_query_tables(query, MYSQL_DATABASE).get(db_name.lower(), set())
+    return sorted(tables)
+
+
+def execute_scripts_from_file(cursor, filename, progress_update_fn, allow_list=None):
+    position = 0
+    for statement in iter_sql_statements(filename):
+        if allow_list is not None and allow_list.skips(statement.text, statement.end - position):
+            progress_update_fn(statement.end - position)
+            position = statement.end
+            continue
         try:
-            cursor.execute(command)
+            cursor.execute(statement.text)
         except pymysql.Error as e:
-            pass
-        progress_update_fn()
+            raise SqlStatementError(filename, statement.offset, e) from e
+        progress_update_fn(statement.end - position)
+        position = statement.end
+    progress_update_fn(os.path.getsize(filename) - position)
 
 def prompt_import():
     user_input = input("\nDo you want to continue with the import? (yes/no): ").lower().strip()
@@ -89,8 +325,7 @@ def prompt_import():
         print("Invalid input. Import cancelled.")
         sys.exit(0)  # Exit the script for any invalid input
 
-def import_sql_files_to_database():
-    expansion = 'vanilla'
+def connect_for_import(db_name=None):
     db = pymysql.connect(
         host=MYSQL_HOST,
         port=MYSQL_PORT,
@@ -104,77 +339,438 @@ def import_sql_files_to_database():
     cursor.execute('SET NAMES utf8mb4')
     cursor.execute("SET CHARACTER SET utf8mb4")
     cursor.execute("SET character_set_connection=utf8mb4")
-    
+    if db_name:
+        cursor.execute(f"USE {db_name};")
+    return db, cursor
+
+
+class ImportAborted(Exception):
+    pass
+
+
+class FileImportStats:
+    def __init__(self):
+        self.statements = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.first_start = None
+        self.last_end = None
+
+
+class ImportWorker(threading.Thread):
+    """
+    Executes the statements routed to it over its own connection. Uncommitted statements are kept so that the
+    current transaction can be replayed after a deadlock, lock wait timeout or lost connection.
+    """
+
+    def __init__(self, worker_id, db_name, bulk, batch_size, pbar, file_stats, stats_lock, stop_event):
+        super().__init__(name=f"import-worker-{worker_id}", daemon=True)
+        self.worker_id = worker_id
+        self.db_name = db_name
+        self.bulk = bulk
+        self.batch_size = batch_size if bulk else 1
+        self.pbar = pbar
+        self.file_stats = file_stats
+        self.stats_lock = stats_lock
+        self.stop_event = stop_event
+        self.queue = queue.Queue(maxsize=IMPORT_QUEUE_SIZE)
+        self.session_statements = []
+        self.batch = []
+        self.batch_bytes = 0
+        self.replay_needed = False
+        self.commit_id = 0
+        self.committing = False
+        self.last_statement = ('<no statement yet>', 0)
+        self.db = None
+        self.error = None
+
+    def connect(self):
+        self.db, self.cursor = connect_for_import(self.db_name)
+        if self.bulk:
+            for setting in BULK_SESSION_SETTINGS:
+                self.cursor.execute(f"SET {setting} = 0")
+        for text in self.session_statements:
+            self.cursor.execute(text)
+
+    def commit(self):
+        self.committing = True
+        if self.batch:
+            self.cursor.execute(f"REPLACE INTO {IMPORT_COMMITS_TABLE} VALUES (%s, %s)",
+                                (self.worker_id, self.commit_id + 1))
+        self.db.commit()
+        if self.batch:
+            self.commit_id += 1
+        self.committing = False
+        self.batch = []
+        self.batch_bytes = 0
+
+    def commit_landed(self):
+        """After a reconnect, whether the commit the connection dropped during was applied."""
+        self.cursor.execute(f"SELECT commit_id FROM {IMPORT_COMMITS_TABLE} WHERE worker = %s", (self.worker_id,))
+        row = self.cursor.fetchone()
+        return row is not None and row[0] == self.commit_id + 1
+
+    def execute(self, text):
+        """Runs text in the current transaction, the caller commits."""
+        if DDL_STATEMENT.match(text):
+            # DDL commits implicitly, keep it out of batches so they can be replayed safely
+            self.commit()
+            self.cursor.execute(text)
+            return
+
+        self.cursor.execute(text)
+        if SESSION_STATEMENT.match(text):
+            self.session_statements.append(text)
+            return
+        self.batch.append(text)
+        self.batch_bytes += len(text)
+
+    def execute_with_retry(self, file, offset, text=None, force_commit=False):
+        """Executes text (if any) and commits when the batch is full or force_commit is set."""
+        if text is not None:
+            self.last_statement = (file, offset)
+        # once text made it into the batch, a retry replays it with the batch instead of running it again
+        executed = text is None
+        for attempt in range(IMPORT_RETRIES + 1):
+            try:
+                if self.replay_needed:
+                    for batch_text in self.batch:
+                        self.cursor.execute(batch_text)
+                    self.replay_needed = False
+                if not executed:
+                    self.execute(text)
+                    executed = True
+                if force_commit or len(self.batch) >= self.batch_size or self.batch_bytes >= IMPORT_BATCH_MAX_BYTES:
+                    self.commit()
+                return
+            except pymysql.err.OperationalError as e:
+                code = e.args[0]
+                if attempt == IMPORT_RETRIES or code not in TRANSIENT_MYSQL_ERRORS | LOST_CONNECTION_MYSQL_ERRORS:
+                    raise SqlStatementError(file, offset, e) from e
+                print(f"{self.name}: retrying {file} at byte {offset} after error {code}")
+                time.sleep(2 ** attempt)
+                if code in LOST_CONNECTION_MYSQL_ERRORS:
+                    self.connect()
+                    if self.committing and self.commit_landed():
+                        # the server committed before the connection dropped, replaying would insert the rows twice
+                        self.commit_id += 1
+                        self.batch = []
+                        self.batch_bytes = 0
+                        force_commit = False
+                else:
+                    self.db.rollback()
+                self.committing = False
+                self.replay_needed = bool(self.batch)
+            except pymysql.Error as e:
+                raise SqlStatementError(file, offset, e) from e
+
+    def run(self):
+        try:
+            self.connect()
+            while (item := self.queue.get()) is not None:
+                if self.stop_event.is_set():
+                    continue  # drain the queue so the reader never blocks
+                if isinstance(item, threading.Event):
+                    # everything queued before it is executed, committed ones are visible to the other connections
+                    self.execute_with_retry(*self.last_statement, force_commit=True)
+                    item.set()
+                    continue
+                file, offset, text, size = item
+                start = time.perf_counter()
+                self.execute_with_retry(file, offset, text)
+                end = time.perf_counter()
+                with self.stats_lock:
+                    stats = self.file_stats[file]
+                    stats.statements += 1
+                    stats.bytes += size
+                    stats.seconds += end - start
+                    stats.first_start = start if stats.first_start is None else min(stats.first_start, start)
+                    stats.last_end = end if stats.last_end is None else max(stats.last_end, end)
+                self.pbar.update(size)
+            self.execute_with_retry(*self.last_statement, force_commit=True)
+            self.db.close()
+        except Exception as e:
+            self.error = e
+            self.stop_event.set()
+            if self.db is not None and self.db.open:
+                self.db.close()
+            while self.queue.get() is not None:
+                pass
+
+    def submit(self, item):
+        while True:
+            if self.stop_event.is_set():
+                raise ImportAborted()
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+
+def wait_for_workers(workers, stop_event):
+    """Blocks until the workers have executed and committed every statement queued so far."""
+    events = []
+    for worker in workers:
+        event = threading.Event()
+        worker.submit(event)
+        events.append(event)
+    for event in events:
+        while not event.wait(timeout=1):
+            if stop_event.is_set():
+                raise ImportAborted()
+
+
+def run_alone(workers, stop_event, item):
+    """Runs a statement that may touch any table once, while no other statement is in flight."""
+    wait_for_workers(workers, stop_event)
+    workers[0].submit(item)
+    wait_for_workers(workers[:1], stop_event)
+
+
+def import_sql_files_in_parallel(db_name, files, jobs, bulk, batch_size, allow_list=None):
+    """
+    Plans the import per table: statements for a given table always go to the same worker (keeping the dump's
+    DROP/CREATE/INSERT order for that table) while different tables load concurrently. Session SET and USE statements
+    are applied on every connection, table locks are dropped, and views/triggers/routines run after all tables are
+    loaded. Statements with no table to route them by (CREATE INDEX...) or that also read another table (INSERT ...
+    SELECT, multi-table UPDATE...) run once, after every worker caught up, so the tables they read are loaded.
+    """
+    file_stats = {file: FileImportStats() for file in files}
+    stats_lock = threading.Lock()
+    stop_event = threading.Event()
+    deferred = []
+    start_time = time.perf_counter()
+
+    with tqdm(total=sum(map(os.path.getsize, files)), unit='B', unit_scale=True, unit_divisor=1024,
+              desc=f'Importing {db_name} ({jobs} connections)', ncols=100) as pbar:
+        db, cursor = connect_for_import(db_name)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {IMPORT_COMMITS_TABLE} "
+                       f"(worker INT PRIMARY KEY, commit_id BIGINT NOT NULL) ENGINE=InnoDB")
+        cursor.execute(f"DELETE FROM {IMPORT_COMMITS_TABLE}")
+        db.commit()
+        db.close()
+
+        workers = [ImportWorker(i, db_name, bulk, batch_size, pbar, file_stats, stats_lock, stop_event)
+                   for i in range(jobs)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            for file in files:
+                position = 0
+                for statement in iter_sql_statements(file):
+                    size = statement.end - position
+                    position = statement.end
+                    if TABLE_LOCK_STATEMENT.match(statement.text) or \
+                            (allow_list is not None and allow_list.skips(statement.text, size)):
+                        pbar.update(size)
+                    elif DEFERRED_STATEMENT.match(statement.text):
+                        deferred.append((file, statement))
+                        pbar.update(size)
+                    else:
+                        table = get_statement_table(statement.text)
+                        if SESSION_STATEMENT.match(statement.text):
+                            for i, worker in enumerate(workers):
+                                worker.submit((file, statement.offset, statement.text, size if i == 0 else 0))
+                        elif table is None or is_multi_table_statement(statement.text):
+                            run_alone(workers, stop_event, (file, statement.offset, statement.text, size))
+                        else:
+                            worker = workers[zlib.crc32(table.lower().encode()) % jobs]
+                            worker.submit((file, statement.offset, statement.text, size))
+                pbar.update(os.path.getsize(file) - position)
+        except ImportAborted:
+            pass  # the failing worker's error is raised below
+        finally:
+            for worker in workers:
+                worker.queue.put(None)
+            for worker in workers:
+                worker.join()
+
+        for worker in workers:
+            if worker.error is not None:
+                raise worker.error
+
+    db, cursor = connect_for_import(db_name)
+    cursor.execute(f"DROP TABLE IF EXISTS {IMPORT_COMMITS_TABLE}")
+    for file, statement in deferred:
+        try:
+            cursor.execute(statement.text)
+        except pymysql.Error as e:
+            raise SqlStatementError(file, statement.offset, e) from e
+    db.commit()
+    db.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"{'file':<60} {'statements':>10} {'MB':>8} {'exec s':>8} {'wall s':>8}")
+    for file, stats in file_stats.items():
+        wall = (stats.last_end - stats.first_start) if stats.first_start is not None else 0.0
+        print(f"{file:<60} {stats.statements:>10} {stats.bytes / 1024 ** 2:>8.1f} {stats.seconds:>8.1f} {wall:>8.1f}")
+    total_statements = sum(stats.statements for stats in file_stats.values())
+    total_bytes = sum(stats.bytes for stats in file_stats.values())
+    print(f"Imported {total_statements} statements ({total_bytes / 1024 ** 2:.1f} MB) in {elapsed:.1f}s over {jobs} "
+          f"connections: {total_statements / elapsed:.0f} statements/s, {total_bytes / 1024 ** 2 / elapsed:.2f} MB/s")
+    if allow_list is not None:
+        allow_list.print_report(total_bytes, elapsed)
+    return total_statements, total_bytes
+
+
+def import_sql_files_to_database(db_dump_dir=None, bulk=False, batch_size=DEFAULT_BULK_BATCH_SIZE, jobs=1,
+                                 all_tables=False, expansion='vanilla'):
+    """Imports an expansion's dump into its schema, returns the number of statements and bytes imported."""
+    db_name = EXPANSIONS[expansion]['schema']
+    exported_files = EXPANSIONS[expansion]['exported_files']
     if expansion == 'vanilla':
-        db_name = MYSQL_DATABASE
-        db_dump_dir = f"assets/sql/db_dump"
+        db_dump_dir = db_dump_dir or f"assets/sql/db_dump"
     else:
-        db_name = f"{expansion}{MYSQL_DATABASE}"
-        db_dump_dir = f"assets/sql/db_dump/{expansion}"
+        db_dump_dir = db_dump_dir or f"assets/sql/db_dump/{expansion}"
+
+    sql_files = find_sql_files(db_dump_dir)
+
+    print(f"Files to be imported:{sql_files}")
+    # prompt_import()
+
+    allow_list = None
+    queried_tables = get_queried_tables(db_name)
+    if not all_tables and queried_tables:
+        # statements for tables the queries never read are skipped without being sent anywhere
+        allow_list = TableAllowList(queried_tables)
+        print(f"Importing only the tables of {db_name} read by the queries: {', '.join(sorted(allow_list.tables))}")
+    elif not all_tables:
+        print(f"No query reads {db_name}, importing all of its tables")
 
+    if DB_BACKEND == 'sqlite':
+        # no server involved, only the tables the queries read are copied into the embedded database
+        return import_sql_files_to_sqlite(sql_files + exported_files, get_sqlite_path(db_name), allow_list)
+
+    db, cursor = connect_for_import()
     print(f"Importing into {db_name} database from {db_dump_dir}")
     cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name};")
     cursor.execute(f"USE {db_name};")
 
-    sql_files = [os.path.join(db_dump_dir, f) for f in os.listdir(db_dump_dir) 
-             if f.endswith(".sql") and os.path.isfile(os.path.join(db_dump_dir, f))]
-        
+    if jobs > 1:
+        cursor.close()
+        db.close()
+        return import_sql_files_in_parallel(db_name, sql_files + exported_files, jobs, bulk, batch_size, allow_list)
 
-    print(f"Files to be imported:{sql_files}")
-    # prompt_import()
-    
-    chunk_size = 1024 * 1024  # 1MB
-    delimiter = b";\n"
-    total_chunks = count_total_chunks(sql_files, delimiter) + sum(map(count_commands_from_file, EXPORTED_FILES))
-
-    def execute_sql_command(command):
-        command = command.strip()
-        if command:
-            # Remove version-specific comment wrappers if present
-            if command.startswith('/*!') and command.endswith('*/'):
-                command = re.sub(r'/\*!\d+\s*(.*?)\s*\*/$', r'\1', command, flags=re.DOTALL)
-            cursor.execute(command)
-
-    with tqdm(total=total_chunks, unit='chunks', desc='Importing SQL files', ncols=100) as pbar:
+    # progress is measured in bytes consumed, so no pre-scan of the dump is needed
+    total_bytes = sum(map(os.path.getsize, sql_files + exported_files))
+
+    imported_statements = 0
+    imported_bytes = 0
+    pending_statements = 0
+
+    def commit():
+        nonlocal pending_statements
+        if not bulk:
+            db.commit()
+            return
+        # In bulk mode transactions span batch_size statements instead of one fsync per INSERT
+        pending_statements += 1
+        if pending_statements >= batch_size:
+            db.commit()
+            pending_statements = 0
+
+    if bulk:
+        cursor.execute("SELECT " + ", ".join(f"@@{setting}" for setting in BULK_SESSION_SETTINGS))
+        previous_settings = dict(zip(BULK_SESSION_SETTINGS, cursor.fetchone()))
+        for setting in BULK_SESSION_SETTINGS:
+            cursor.execute(f"SET {setting} = 0")
+        print(f"Bulk import mode: committing every {batch_size} statements with "
+              f"{', '.join(BULK_SESSION_SETTINGS)} disabled")
+
+    start_time = time.perf_counter()
+
+    with tqdm(total=total_bytes, unit='B', unit_scale=True, unit_divisor=1024,
+              desc=f'Importing {db_name}', ncols=100) as pbar:
         for file in sql_files:
-            with open(file, "rb") as f:
-                buffer = bytearray()
-                while chunk := f.read(chunk_size):
-                    buffer.extend(chunk)
-                    while delimiter in buffer:
-                        pos = buffer.index(delimiter)
-                        try:
-                            sql_command = buffer[:pos].decode('utf-8')
-                            execute_sql_command(sql_command)
-                            db.commit()
-                        except pymysql.Error as e:
-                            print(f"Error importing {file}: {e}")
-                            # print(f"Problematic SQL command: {sql_command}")
-                            raise
-                        buffer = buffer[pos+len(delimiter):]
-                        pbar.update(1)  # Update progress bar for each chunk
-                # Execute any remaining SQL commands
-                if buffer:
-                    try:
-                        sql_command = buffer.decode('utf-8')
-                        execute_sql_command(sql_command)
-                        db.commit()
-                    except pymysql.Error as e:
-                        print(f"Error importing {file}: {e}")
-                        # print(f"Problematic SQL command: {sql_command}")
-                        raise
+            position = 0
+            for statement in iter_sql_statements(file):
+                size = statement.end - position
+                pbar.update(size)
+                position = statement.end
+                if allow_list is not None and allow_list.skips(statement.text, size):
+                    continue
+                try:
+                    cursor.execute(statement.text)
+                    commit()
+                except pymysql.Error as e:
+                    raise SqlStatementError(file, statement.offset, e) from e
+                imported_statements += 1
+                imported_bytes += size
+            pbar.update(os.path.getsize(file) - position)
             print(f'Imported {file}')
 
-        for file in EXPORTED_FILES:
-            execute_scripts_from_file(cursor, file, progress_update_fn=lambda: pbar.update(1))
+        for file in exported_files:
+            execute_scripts_from_file(cursor, file, progress_update_fn=pbar.update, allow_list=allow_list)
 
     db.commit()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Imported {imported_statements} statements ({imported_bytes / 1024 ** 2:.1f} MB) in {elapsed:.1f}s: "
+          f"{imported_statements / elapsed:.0f} statements/s, {imported_bytes / 1024 ** 2 / elapsed:.2f} MB/s")
+    if allow_list is not None:
+        allow_list.print_report(imported_bytes, elapsed)
+
+    if bulk:
+        for setting, value in previous_settings.items():
+            cursor.execute(f"SET {setting} = {int(value)}")
+
     cursor.close()
     db.close()
+    return imported_statements, imported_bytes
+
+
+def import_expansion(expansion, source, bulk, batch_size, jobs, all_tables):
+    start_time = time.perf_counter()
+    db_dump_dir = download_and_extract_latest_db_dump(source, expansion)
+    download_seconds = time.perf_counter() - start_time
+    statements, imported_bytes = import_sql_files_to_database(db_dump_dir, bulk=bulk, batch_size=batch_size, jobs=jobs,
+                                                              all_tables=all_tables, expansion=expansion)
+    return {
+        'download_seconds': download_seconds,
+        'import_seconds': time.perf_counter() - start_time - download_seconds,
+        'statements': statements,
+        'bytes': imported_bytes,
+    }
+
+
+def import_expansions(expansions, source=None, bulk=False, batch_size=DEFAULT_BULK_BATCH_SIZE, jobs=1,
+                      all_tables=False):
+    """
+    Downloads and imports several expansions at once, each into its own schema with its own exported DBC tables.
+    jobs is the number of connections used by each expansion.
+    """
+    unknown = [expansion for expansion in expansions if expansion not in EXPANSIONS]
+    if unknown:
+        raise Exception(f"Unknown expansion(s) {', '.join(unknown)}, expected some of {', '.join(EXPANSIONS)}")
+    if source is not None and len(expansions) > 1:
+        raise Exception("--source can only be used when importing a single expansion")
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(expansions)) as executor:
+        futures = {expansion: executor.submit(import_expansion, expansion, source, bulk, batch_size, jobs, all_tables)
+                   for expansion in expansions}
+        # wait for every expansion before raising, so a failure does not leave other imports running unnoticed
+        errors = [future.exception() for future in futures.values()]
+        results = {expansion: future.result() for expansion, future in futures.items() if future.exception() is None}
+    elapsed = time.perf_counter() - start_time
+
+    print(f"{'expansion':<10} {'schema':<14} {'download s':>10} {'import s':>9} {'statements':>11} {'MB':>9}")
+    for expansion, result in results.items():
+        print(f"{expansion:<10} {EXPANSIONS[expansion]['schema']:<14} {result['download_seconds']:>10.1f} "
+              f"{result['import_seconds']:>9.1f} {result['statements']:>11} {result['bytes'] / 1024 ** 2:>9.1f}")
+    total_seconds = sum(result['download_seconds'] + result['import_seconds'] for result in results.values())
+    print(f"Imported {len(results)} of {len(expansions)} expansions in {elapsed:.1f}s "
+          f"({total_seconds:.1f}s if run one after another)")
+
+    for error in errors:
+        if error is not None:
+            raise error
 
 
 if __name__ == "__main__":
-    download_and_extract_latest_db_dump()
-    import_sql_files_to_database()
+    db_dump_dir = download_and_extract_latest_db_dump()
+    import_sql_files_to_database(db_dump_dir)
     
     print("Database initialized successfully.")
@@ -1,28 +1,112 @@
 import os
-import mutagen.mp3
+import json
+import threading
+import mutagen
+from tts_cli.utils import write_file_if_changed
 
 DATAMODULE_TABLE_GUARD_CLAUSE = 'if not VoiceOver or not VoiceOver.DataModules then return end'
 
+SOUND_FILE_EXTENSIONS = ('.mp3', '.ogg')
+
+# Sidecar store written next to the generated sounds: one JSON object per line, appended as each clip is synthesized.
+# The last entry for a given file wins, so re-generating a clip simply appends a newer record.
+SOUND_LENGTH_STORE_FILENAME = 'sound_lengths.jsonl'
+
+store_lock = threading.Lock()
+
+
+def get_sound_length_store_path(sound_folder_path: str):
+    return os.path.join(sound_folder_path, SOUND_LENGTH_STORE_FILENAME)
+
+
+def get_sound_store_key(sound_folder_path: str, sound_file_path: str):
+    return os.path.relpath(sound_file_path, sound_folder_path).replace(os.sep, '/')
+
+
+def record_sound_length(sound_folder_path: str, sound_file_path: str, length: float, size: int):
+    record_sound_lengths(sound_folder_path, [(sound_file_path, length, size)])
+
+
+def record_sound_lengths(sound_folder_path: str, sounds):
+    """Appends (sound file path, length, size) entries to the store with a single fsync."""
+    lines = []
+    for sound_file_path, length, size in sounds:
+        entry = {
+            'file': get_sound_store_key(sound_folder_path, sound_file_path),
+            'length': length,
+            'size': size,
+        }
+        lines.append(json.dumps(entry) + "\n")
+
+    with store_lock:
+        with open(get_sound_length_store_path(sound_folder_path), "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def load_sound_length_store(sound_folder_path: str):
+    store_path = get_sound_length_store_path(sound_folder_path)
+    entries = {}
+
+    if not os.path.isfile(store_path):
+        return entries
+
+    with open(store_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # torn last line left behind by an interrupted run
+                continue
+            entries[entry['file']] = entry
+
+    return entries
+
+
+def read_sound_length_from_header(sound_file_path: str):
+    audio = mutagen.File(sound_file_path)
+    if audio is None or audio.info is None:
+        return None
+    return audio.info.length
+
+
 def write_sound_length_table_lua(module_name: str, sound_folder_path: str, output_folder_path: str):
 
-    mp3_files = []
+    sound_files = []
 
     for root, dirs, files in os.walk(sound_folder_path):
         for f in files:
-            if f.endswith(".mp3"):
-                mp3_files.append(os.path.join(root, f))
+            if f.endswith(SOUND_FILE_EXTENSIONS):
+                sound_files.append(os.path.join(root, f))
+
+    store = load_sound_length_store(sound_folder_path)
 
-    # Create a Lua table mapping the name of the sound to its length in seconds
+    # Create a Lua table mapping the name of the sound to its length in seconds.
+    # Lengths recorded at synthesis time are trusted as long as the file on disk still has the recorded size,
+    # anything else (files produced outside the pipeline, replaced files) falls back to parsing the audio header.
     soundDict = {}
-    for mp3_file in mp3_files:
-        audio = mutagen.mp3.MP3(mp3_file)
-        length = audio.info.length
-        soundDict[os.path.splitext(os.path.basename(mp3_file))[0]] = length
-
-    # Write the dictionary to the output file in Lua table format
-    with open(output_folder_path + '/sound_length_table.lua', "w") as f:
-        f.write(DATAMODULE_TABLE_GUARD_CLAUSE + "\n")
-        f.write(f"{module_name}.SoundLengthLookupByFileName = {{\n")
-        for key, value in soundDict.items():
-            f.write(f"    [\"{key}\"] = {value},\n")
-        f.write("}\n")
+    from_store = 0
+    from_header = 0
+    for sound_file in sound_files:
+        entry = store.get(get_sound_store_key(sound_folder_path, sound_file))
+        if entry is not None and entry['size'] == os.path.getsize(sound_file):
+            length = entry['length']
+            from_store += 1
+        else:
+            length = read_sound_length_from_header(sound_file)
+            if length is None:
+                print(f"Skipping {sound_file}: unable to read its length")
+                continue
+            from_header += 1
+        soundDict[os.path.splitext(os.path.basename(sound_file))[0]] = length
+
+    print(f"Sound lengths: {from_store} from the synthesis store, {from_header} parsed from file headers")
+
+    # Write the dictionary to the output file in Lua table format, sorted so unchanged sounds produce an identical file
+    lines = [DATAMODULE_TABLE_GUARD_CLAUSE + "\n", f"{module_name}.SoundLengthLookupByFileName = {{\n"]
+    for key in sorted(soundDict):
+        lines.append(f"    [\"{key}\"] = {soundDict[key]},\n")
+    lines.append("}\n")
+
+    return write_file_if_changed(output_folder_path + '/sound_length_table.lua', "".join(lines))
@@ -0,0 +1,242 @@
+import os
+import re
+import time
+from collections import defaultdict
+from slpp import slpp as lua
+from tqdm import tqdm
+from tts_cli.fuzzy_search import LUA_WORD_PATTERN, tokenize, jaccard_similarity
+
+LUA_TABLE_ASSIGNMENT = re.compile(r'^\s*[\w.]+\.(\w+)\s*=\s*', re.MULTILINE)
+
+GOSSIP_TABLES_BY_ID = {'creature': 'GossipLookupByNPCID', 'gameobject': 'GossipLookupByObjectID'}
+GOSSIP_TABLES_BY_NAME = {'creature': 'GossipLookupByNPCName', 'gameobject': 'GossipLookupByObjectName'}
+
+# Stand-ins for what the client substitutes into quest and gossip text before the addon sees it
+GAME_TEXT_REPLACEMENTS = [
+    (re.compile(r'\$[Bb]'), '\n'),
+    (re.compile(r'\$[Gg]\s*([^:;]+?)\s*:\s*([^:;]+?)\s*;'), r'\1'),
+    (re.compile(r'\$[NnCcRr]'), 'Aventurier'),
+]
+
+
+def load_lua_table(path):
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    match = LUA_TABLE_ASSIGNMENT.search(content)
+    if match is None:
+        raise Exception(f"No table assignment found in {path}")
+
+    return match.group(1), lua.decode(content[match.end():])
+
+
+def load_generated_tables(output_folder):
+    tables = {}
+    for filename in sorted(os.listdir(output_folder)):
+        if filename.endswith(".lua"):
+            name, data = load_lua_table(os.path.join(output_folder, filename))
+            tables[name] = data
+    return tables
+
+
+def render_game_text(text):
+    for pattern, replacement in GAME_TEXT_REPLACEMENTS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def replace_double_quotes(text):
+    return text.replace('"', "'")
+
+
+def get_first_n_words(text, n):
+    return ' '.join(LUA_WORD_PATTERN.findall(text)[:n])
+
+
+def get_last_n_words(text, n):
+    return ' '.join(LUA_WORD_PATTERN.findall(text)[-n:])
+
+
+class LookupStats:
+    def __init__(self):
+        self.lookups = 0
+        self.correct = 0
+        self.mis_resolved = 0
+        self.unresolved = 0
+        self.ambiguous = 0
+        self.missing_sound = 0
+        self.candidates_scanned = 0
+        self.max_candidates_scanned = 0
+        self.tokens_compared = 0
+        self.seconds = 0.0
+        self.failures = []
+
+
+class LookupSimulator:
+    """
+    Replays corpus lines through Python reimplementations of the addon's DataModules lookups
+    (GetQuestID, GetNPCGossipTextHash and FuzzySearchBestKeys) against the generated Lua tables.
+    The generated module is treated as the only registered data module.
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.stats = defaultdict(LookupStats)
+        # tokenized table keys are cached, the cost model counts them as if Lua re-tokenized every time
+        self.token_cache = {}
+
+    def get_tokens(self, text):
+        tokens = self.token_cache.get(text)
+        if tokens is None:
+            tokens = self.token_cache[text] = tokenize(text)
+        return tokens
+
+    def fuzzy_search_best_keys(self, query, table_var, stats):
+        query_tokens = tokenize(query)
+        best_result = None
+        max_similarity = -1
+        tie = False
+
+        for entry, value in table_var.items():
+            entry_tokens = self.get_tokens(entry)
+            stats.tokens_compared += len(query_tokens) + len(entry_tokens)
+            similarity = jaccard_similarity(query_tokens, entry_tokens)
+            if similarity > max_similarity:
+                max_similarity = similarity
+                best_result = {'value': value, 'text': entry, 'similarity': similarity}
+                tie = False
+            elif similarity == max_similarity and value != best_result['value']:
+                # pairs() order decides the winner in game
+                tie = True
+
+        stats.candidates_scanned += len(table_var)
+        stats.max_candidates_scanned = max(stats.max_candidates_scanned, len(table_var))
+        if tie:
+            stats.ambiguous += 1
+
+        return best_result
+
+    def get_quest_id(self, source, title, npc_name, text, stats):
+        cleaned_title = replace_double_quotes(title)
+        cleaned_npc_name = replace_double_quotes(npc_name)
+        cleaned_text = replace_double_quotes(get_first_n_words(text, 15)) + \
+            " " + replace_double_quotes(get_last_n_words(text, 15))
+        text_entries = {}
+
+        data = self.tables.get('QuestIDLookup')
+        if data:
+            title_lookup = data.get(source, {}).get(cleaned_title)
+            if title_lookup is not None:
+                if not isinstance(title_lookup, dict):
+                    return title_lookup
+                npc_lookup = title_lookup.get(cleaned_npc_name)
+                if npc_lookup is not None:
+                    if not isinstance(npc_lookup, dict):
+                        return npc_lookup
+                    for entry_text, quest_id in npc_lookup.items():
+                        text_entries.setdefault(entry_text, quest_id)
+
+        best_result = self.fuzzy_search_best_keys(cleaned_text, text_entries, stats)
+        return best_result and best_result['value']
+
+    def get_npc_gossip_text_hash(self, table, npc, text, stats):
+        text_entries = {}
+
+        data = self.tables.get(table)
+        if data:
+            npc_gossip_table = data.get(npc)
+            if npc_gossip_table:
+                for entry_text, text_hash in npc_gossip_table.items():
+                    text_entries.setdefault(entry_text, text_hash)
+
+        best_result = self.fuzzy_search_best_keys(text, text_entries, stats)
+        return best_result and best_result['value']
+
+    def has_sound(self, file_name):
+        sound_lengths = self.tables.get('SoundLengthLookupByFileName')
+        if not sound_lengths:
+            return True
+        return any(name in sound_lengths for name in (file_name, 'm-' + file_name, 'f-' + file_name))
+
+    def check(self, kind, expected, lookup, sound_file_name, description):
+        stats = self.stats[kind]
+        start = time.perf_counter()
+        result = lookup(stats)
+        stats.seconds += time.perf_counter() - start
+        stats.lookups += 1
+
+        if result is None:
+            stats.unresolved += 1
+            stats.failures.append(f"unresolved: {description}")
+        elif result != expected:
+            stats.mis_resolved += 1
+            stats.failures.append(f"got {result}, expected {expected}: {description}")
+        else:
+            stats.correct += 1
+            if not self.has_sound(sound_file_name):
+                stats.missing_sound += 1
+
+    def replay(self, df):
+        df = df.drop_duplicates(subset=['source', 'quest', 'quest_title', 'text', 'name', 'type', 'id'])
+
+        for _, row in tqdm(df.iterrows(), total=len(df), desc="Replaying lookups"):
+            text = render_game_text(row['text'])
+
+            if row['quest'] != '':
+                if row['source'] == 'progress':  # progress text is not part of QuestIDLookup
+                    continue
+                quest_id = int(row['quest'])
+                self.check('GetQuestID', quest_id,
+                           lambda stats: self.get_quest_id(row['source'], row['quest_title'], row['name'], text, stats),
+                           f"{quest_id}-{row['source']}", f"quest {quest_id} {row['source']} ({row['name']})")
+                continue
+
+            if row['type'] not in GOSSIP_TABLES_BY_ID:
+                continue
+            text_hash = row['templateText_race_gender_hash']
+            self.check(f"GetNPCGossipTextHash by ID ({row['type']})", text_hash,
+                       lambda stats: self.get_npc_gossip_text_hash(GOSSIP_TABLES_BY_ID[row['type']], row['id'], text, stats),
+                       text_hash, f"{row['type']} {row['id']}: {row['text'][:60]!r}")
+            self.check(f"GetNPCGossipTextHash by name ({row['type']})", text_hash,
+                       lambda stats: self.get_npc_gossip_text_hash(GOSSIP_TABLES_BY_NAME[row['type']],
+                                                                   replace_double_quotes(row['name']), text, stats),
+                       text_hash, f"{row['type']} {row['name']!r}: {row['text'][:60]!r}")
+
+    def count_ambiguous_keys(self):
+        """Counts table keys sharing their token set with another key of the same NPC that maps to a different value."""
+        ambiguous = {}
+        for table in list(GOSSIP_TABLES_BY_ID.values()) + list(GOSSIP_TABLES_BY_NAME.values()):
+            count = 0
+            for npc_table in (self.tables.get(table) or {}).values():
+                values_by_tokens = defaultdict(set)
+                for entry_text, value in npc_table.items():
+                    values_by_tokens[frozenset(self.get_tokens(entry_text))].add(value)
+                count += sum(len(values) for values in values_by_tokens.values() if len(values) > 1)
+            ambiguous[table] = count
+        return ambiguous
+
+    def print_report(self, max_failures=10):
+        print(f"{'lookup':<45} {'lookups':>8} {'correct':>8} {'wrong':>6} {'none':>6} {'tie':>6} "
+              f"{'nosound':>7} {'cand/avg':>8} {'cand/max':>8} {'tok/avg':>8} {'us/avg':>8}")
+        for kind, stats in self.stats.items():
+            n = max(stats.lookups, 1)
+            print(f"{kind:<45} {stats.lookups:>8} {stats.correct:>8} {stats.mis_resolved:>6} {stats.unresolved:>6} "
+                  f"{stats.ambiguous:>6} {stats.missing_sound:>7} {stats.candidates_scanned / n:>8.1f} "
+                  f"{stats.max_candidates_scanned:>8} {stats.tokens_compared / n:>8.1f} {1e6 * stats.seconds / n:>8.1f}")
+
+        print("\nKeys sharing their token set with a differently resolving key of the same NPC:")
+        for table, count in self.count_ambiguous_keys().items():
+            print(f"  {table}: {count}")
+
+        for kind, stats in self.stats.items():
+            if stats.failures:
+                print(f"\nFirst failures for {kind}:")
+                for failure in stats.failures[:max_failures]:
+                    print(f"  {failure}")
+
+
+def simulate_lookups(df, output_folder):
+    simulator = LookupSimulator(load_generated_tables(output_folder))
+    simulator.replay(df)
+    simulator.print_report()
+    return simulator
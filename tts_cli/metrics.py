@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import threading
+import datetime
+from contextlib import contextmanager
+
+METRICS_EVENTS_PREFIX = "run-"
+PROMETHEUS_FILENAME = "voiceover.prom"
+PROMETHEUS_PREFIX = "voiceover_"
+# the Prometheus file is rewritten at most this often while rows are processed, and once more at the end
+PROMETHEUS_WRITE_INTERVAL_SECONDS = 5.0
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRecorder:
+    """
+    Collects timings of the pipeline stages and one record per generated row. Nothing is written until start() is
+    called, so the instrumentation costs a few perf_counter() calls on commands that do not export metrics.
+
+    Once started, every stage, row and run event is appended to a JSON lines file and the running totals are
+    written in the Prometheus text format to PROMETHEUS_FILENAME, where a local scraper (e.g. the node exporter
+    textfile collector) can pick them up.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.output_dir = None
+        self.events_file = None
+        self.started = None
+        self.last_prometheus_write = 0.0
+        # stage: [calls, seconds]
+        self.stages = {}
+        self.rows = {}
+        self.failures = {}
+        self.chars = 0
+        self.audio_seconds = 0.0
+        self.inference_seconds = 0.0
+        # locale: {rows, chars, audio_seconds, worker_seconds} of its ok rows, for multi-locale runs
+        self.locales = {}
+        # name: function returning {stat: number}, exported as gauges
+        self.stats_sources = {}
+
+    def start(self, output_dir, command):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.started = time.time()
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.events_file = open(os.path.join(output_dir, f"{METRICS_EVENTS_PREFIX}{stamp}.jsonl"), "a",
+                                encoding="utf-8")
+        self.write_event({'type': 'run_start', 'command': command, 'pid': os.getpid()})
+        print(f"Writing metrics to {self.events_file.name} and {os.path.join(output_dir, PROMETHEUS_FILENAME)}")
+
+    def add_stats_source(self, name, get_stats):
+        self.stats_sources[name] = get_stats
+
+    def write_event(self, event):
+        if self.events_file is None:
+            return
+        line = json.dumps({'time': round(time.time(), 3), **event}, ensure_ascii=False)
+        with self.lock:
+            self.events_file.write(line + "\n")
+            self.events_file.flush()
+
+    def observe(self, stage, seconds, **fields):
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+        row = getattr(self.local, 'row', None)
+        if row is not None:
+            row['stages'][stage] = round(row['stages'].get(stage, 0.0) + seconds, 6)
+        elif self.events_file is not None:
+            # stages inside a row are reported with the row
+            self.write_event({'type': 'stage', 'stage': stage, 'seconds': round(seconds, 6), **fields})
+
+    @contextmanager
+    def stage(self, stage, **fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **fields)
+
+    @contextmanager
+    def row(self, **fields):
+        """Groups the stages of one generated row, run on the current thread, into a single row event."""
+        row = {'worker': threading.current_thread().name, 'status': 'ok', **fields, 'stages': {}}
+        self.local.row = row
+        start = time.perf_counter()
+        try:
+            yield row
+        except BaseException as e:
+            row.update(status='failed', reason=type(e).__name__, error=str(e))
+            raise
+        finally:
+            self.local.row = None
+            row['seconds'] = round(time.perf_counter() - start, 6)
+            self.record_row(row)
+
+    def annotate(self, **fields):
+        """Adds fields (chars, audio_seconds, status, reason...) to the row being processed on this thread."""
+        row = getattr(self.local, 'row', None)
+        if row is not None:
+            row.update(fields)
+
+    def record_row(self, row):
+        inference = row['stages'].get('model_inference')
+        if inference is not None and row.get('audio_seconds'):
+            row['rtf'] = round(inference / row['audio_seconds'], 4)
+
+        with self.lock:
+            self.rows[row['status']] = self.rows.get(row['status'], 0) + 1
+            if row['status'] == 'failed':
+                self.failures[row.get('reason', 'unknown')] = self.failures.get(row.get('reason', 'unknown'), 0) + 1
+            if row['status'] == 'ok':
+                self.chars += row.get('chars', 0)
+                self.audio_seconds += row.get('audio_seconds', 0.0)
+                self.inference_seconds += inference or 0.0
+                if 'locale' in row:
+                    totals = self.locales.setdefault(row['locale'], dict.fromkeys(
+                        ['rows', 'chars', 'audio_seconds', 'worker_seconds'], 0))
+                    totals['rows'] += 1
+                    totals['chars'] += row.get('chars', 0)
+                    totals['audio_seconds'] += row.get('audio_seconds', 0.0)
+                    totals['worker_seconds'] += row['seconds'] - row['stages'].get('queue_wait', 0.0)
+
+        self.write_event({'type': 'row', **row})
+        if time.monotonic() - self.last_prometheus_write >= PROMETHEUS_WRITE_INTERVAL_SECONDS:
+            self.write_prometheus()
+
+    def get_prometheus_text(self):
+        def metric(name, kind, help_text, samples):
+            lines = [f"# HELP {PROMETHEUS_PREFIX}{name} {help_text}", f"# TYPE {PROMETHEUS_PREFIX}{name} {kind}"]
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+                lines.append(f"{PROMETHEUS_PREFIX}{name}{{{label_text}}} {value}" if label_text
+                             else f"{PROMETHEUS_PREFIX}{name} {value}")
+            return lines
+
+        with self.lock:
+            stages = sorted(self.stages.items())
+            rows = sorted(self.rows.items())
+            failures = sorted(self.failures.items())
+            chars, audio_seconds, inference_seconds = self.chars, self.audio_seconds, self.inference_seconds
+            locales = sorted((locale, dict(totals)) for locale, totals in self.locales.items())
+
+        lines = []
+        lines += metric('run_start_timestamp_seconds', 'gauge', 'Start of the generation run.', [({}, self.started)])
+        lines += metric('stage_seconds_total', 'counter', 'Time spent in each pipeline stage.',
+                        [({'stage': stage}, round(seconds, 6)) for stage, (_, seconds) in stages])
+        lines += metric('stage_calls_total', 'counter', 'Number of times each pipeline stage ran.',
+                        [({'stage': stage}, calls) for stage, (calls, _) in stages])
+        lines += metric('rows_total', 'counter', 'Rows processed by outcome.',
+                        [({'status': status}, count) for status, count in rows])
+        lines += metric('row_failures_total', 'counter', 'Failed rows by exception type.',
+                        [({'reason': reason}, count) for reason, count in failures])
+        lines += metric('chars_total', 'counter', 'Characters of text synthesized.', [({}, chars)])
+        lines += metric('audio_seconds_total', 'counter', 'Seconds of audio synthesized.',
+                        [({}, round(audio_seconds, 3))])
+        lines += metric('real_time_factor', 'gauge', 'Model inference time per second of audio over the run.',
+                        [({}, round(inference_seconds / audio_seconds, 4) if audio_seconds else 0)])
+        for stat, help_text in [('rows', 'Rows generated per locale.'),
+                                ('chars', 'Characters synthesized per locale.'),
+                                ('audio_seconds', 'Seconds of audio synthesized per locale.'),
+                                ('worker_seconds', 'Worker time spent on the rows of each locale.')]:
+            lines += metric(f'locale_{stat}_total', 'counter', help_text,
+                            [({'locale': locale}, round(totals[stat], 3)) for locale, totals in locales])
+        for name, get_stats in sorted(self.stats_sources.items()):
+            for stat, value in get_stats().items():
+                lines += metric(f"{name}_{stat}", 'gauge', f"{name} {stat.replace('_', ' ')}.", [({}, value)])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        if self.output_dir is None:
+            return
+        self.last_prometheus_write = time.monotonic()
+        path = os.path.join(self.output_dir, PROMETHEUS_FILENAME)
+        # scrapers must never see a half written file
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.get_prometheus_text())
+        os.replace(temp_path, path)
+
+    def print_report(self):
+        if self.started is None or not self.stages:
+            return
+        print("Stage                      calls    total s     mean ms")
+        for stage, (calls, seconds) in sorted(self.stages.items(), key=lambda item: item[1][1], reverse=True):
+            print(f"{stage:<25} {calls:>7} {seconds:>10.2f} {seconds * 1000 / calls:>11.1f}")
+        if self.rows:
+            print(f"Rows: {', '.join(f'{count} {status}' for status, count in sorted(self.rows.items()))}, "
+                  f"{self.chars} chars, {self.audio_seconds:.1f}s of audio"
+                  + (f", real-time factor {self.inference_seconds / self.audio_seconds:.2f}"
+                     if self.audio_seconds else ""))
+        if self.locales:
+            # rows of every locale share the workers, throughput is per second of worker time
+            print("Locale      rows     chars    audio s   chars/s   audio s/s")
+            for locale, totals in sorted(self.locales.items()):
+                worker_seconds = max(totals['worker_seconds'], 1e-9)
+                print(f"{locale:<8} {totals['rows']:>7} {totals['chars']:>9} {totals['audio_seconds']:>10.1f} "
+                      f"{totals['chars'] / worker_seconds:>9.1f} {totals['audio_seconds'] / worker_seconds:>11.2f}")
+
+    def close(self):
+        if self.events_file is None:
+            return
+        self.write_event({'type': 'run_end', 'seconds': round(time.time() - self.started, 3),
+                          'stats': {name: get_stats() for name, get_stats in self.stats_sources.items()}})
+        self.write_prometheus()
+        self.events_file.close()
+        self.events_file = None
+
+
+# shared by the whole pipeline, stages are timed with `with metrics.stage("name"):`
+metrics = MetricsRecorder()
@@ -0,0 +1,187 @@
+import os
+import io
+import sys
+import pstats
+import cProfile
+import datetime
+import threading
+from contextlib import contextmanager
+
+PROFILE_DIR = "profiles"
+# (stage, [(file name suffix, function name)]) whose callee subtrees get their own hot function listing
+PROFILE_STAGES = [
+    ('sql import', [('init_db.py', 'execute_scripts_from_file'), ('init_db.py', 'execute_with_retry'),
+                    ('sqlite_backend.py', 'import_sql_files_to_sqlite')]),
+    ('query_dataframe', [('sql_queries.py', 'query_dataframe')]),
+    ('preprocess_dataframe', [('tts_utils.py', 'preprocess_dataframe')]),
+    ('syn.tts', [('synthesizer.py', 'tts')]),
+    ('lua.encode', [('slpp.py', 'encode')]),
+    ('lookup simulation', [('lookup_simulator.py', 'replay')]),
+]
+PROFILE_TOP_FUNCTIONS = 25
+PROFILE_STAGE_TOP_FUNCTIONS = 15
+# torch.profiler adds a lot of overhead, only the first calls are traced
+TORCH_PROFILE_CALLS = 3
+
+active_session = None
+
+
+class ProfileSession:
+    """
+    cProfile over a whole command. Before Python 3.12 a profiler only sees the thread that enabled it, so every
+    thread started while profiling (pool workers, import workers) gets its own profiler, dumped to its own file.
+    From 3.12 on cProfile sees every thread and a single profiler is used.
+    """
+
+    def __init__(self, output_dir, command):
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.output_dir = os.path.join(output_dir, f"{command}-{stamp}")
+        self.per_thread = sys.version_info < (3, 12)
+        self.lock = threading.Lock()
+        self.thread_profiles = []
+        self.main_profile = cProfile.Profile()
+        self.torch_lock = threading.Lock()
+        self.torch_calls = 0
+        self.torch_tables = []
+
+    def profile_new_thread(self, frame, event, arg):
+        # installed by threading.setprofile, this runs on the first event of each new thread and hands over to cProfile
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append((threading.current_thread().name, profile))
+        profile.enable()
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.per_thread:
+            threading.setprofile(self.profile_new_thread)
+        self.main_profile.enable()
+
+    def stop(self):
+        self.main_profile.disable()
+        threading.setprofile(None)
+
+        paths = [os.path.join(self.output_dir, "MainThread.prof")]
+        self.main_profile.dump_stats(paths[0])
+        with self.lock:
+            thread_profiles = list(self.thread_profiles)
+        for index, (name, profile) in enumerate(thread_profiles):
+            path = os.path.join(self.output_dir, f"{index:03d}-{name}.prof")
+            profile.dump_stats(path)
+            paths.append(path)
+
+        report_path = os.path.join(self.output_dir, "report.txt")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(get_report(paths, self.torch_tables))
+        print(f"Profiles of {len(paths)} threads written to {self.output_dir}, merged report in {report_path}")
+
+    def take_torch_call(self):
+        with self.lock:
+            if self.torch_calls >= TORCH_PROFILE_CALLS:
+                return None
+            self.torch_calls += 1
+            return self.torch_calls
+
+
+def start_profiling(output_dir, command):
+    global active_session
+    active_session = ProfileSession(output_dir, command)
+    active_session.start()
+    print(f"Profiling {command} into {active_session.output_dir}")
+
+
+def stop_profiling():
+    global active_session
+    if active_session is None:
+        return
+    session, active_session = active_session, None
+    session.stop()
+
+
+@contextmanager
+def torch_profile(label):
+    """Traces the block with torch.profiler on CPU for the first TORCH_PROFILE_CALLS calls of a profiling run."""
+    session = active_session
+    call = session.take_torch_call() if session is not None else None
+    if call is None:
+        yield
+        return
+
+    # only reached from the synthesis path, which has torch loaded already
+    from torch.profiler import profile, ProfilerActivity
+    # the torch profiler is process wide, traced calls take turns
+    with session.torch_lock:
+        with profile(activities=[ProfilerActivity.CPU]) as prof:
+            yield
+        prof.export_chrome_trace(os.path.join(session.output_dir, f"torch-{label}-{call}.json"))
+        session.torch_tables.append((f"{label} #{call}", prof.key_averages().table(sort_by="self_cpu_time_total",
+                                                                                   row_limit=20)))
+
+
+def get_stats_text(stats, sort, limit):
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+def get_subtree(stats, roots):
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller in callers:
+            callees.setdefault(caller, set()).add(func)
+
+    subtree = set(roots)
+    pending = list(roots)
+    while pending:
+        func = pending.pop()
+        # built-ins (isinstance, sorted...) call back into Python code from everywhere, their recorded callees
+        # would drag unrelated parts of the program into the stage
+        if func[0] == '~' and func not in roots:
+            continue
+        for callee in callees.get(func, ()):
+            if callee not in subtree:
+                subtree.add(callee)
+                pending.append(callee)
+    return subtree
+
+
+def get_stage_text(stats, roots, limit):
+    """Hot functions under roots, counting only the calls made from inside the subtree."""
+    subtree = get_subtree(stats, roots)
+    rows = []
+    for func in subtree:
+        _, ncalls, tottime, cumtime, callers = stats.stats[func]
+        if func not in roots:
+            edges = [edge for caller, edge in callers.items() if caller in subtree]
+            ncalls = sum(edge[1] for edge in edges)
+            tottime = sum(edge[2] for edge in edges)
+            cumtime = sum(edge[3] for edge in edges)
+        rows.append((tottime, ncalls, cumtime, func))
+
+    lines = ["   ncalls  tottime  cumtime  function"]
+    for tottime, ncalls, cumtime, func in sorted(rows, key=lambda row: row[0], reverse=True)[:limit]:
+        lines.append(f"{ncalls:>9} {tottime:>8.3f} {cumtime:>8.3f}  {pstats.func_std_string(func)}")
+    return "\n".join(lines) + "\n"
+
+
+def get_report(paths, torch_tables=()):
+    """Merges the per-thread profiles into the overall hot functions and the hot functions under each stage."""
+    stats = pstats.Stats(*paths)
+    report = [f"Merged profile of {len(paths)} threads\n",
+              get_stats_text(stats, 'cumulative', PROFILE_TOP_FUNCTIONS),
+              get_stats_text(stats, 'tottime', PROFILE_TOP_FUNCTIONS)]
+
+    for stage, patterns in PROFILE_STAGES:
+        roots = [func for func in stats.stats
+                 if any(func[0].endswith(suffix) and func[2] == name for suffix, name in patterns)]
+        if not roots:
+            continue
+        # recursive calls are counted once by cumtime, the outermost entry is the stage total
+        total = max(stats.stats[root][3] for root in roots)
+        report.append(f"\n=== {stage}: {total:.3f}s cumulative, hot functions below it ===\n")
+        report.append(get_stage_text(stats, roots, PROFILE_STAGE_TOP_FUNCTIONS))
+
+    for label, table in torch_tables:
+        report.append(f"\n=== torch.profiler {label} ===\n{table}\n")
+    return "".join(report)
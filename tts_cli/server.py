@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import queue
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+import pandas as pd
+from tts_cli.tts_utils import TTSProcessor, STATIC_MAX_WORKERS, SOUND_INPUT_FOLDER, get_sound_file_path
+from tts_cli.consts import RACE_DICT_INV, GENDER_DICT_INV
+from tts_cli.metrics import metrics
+
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 8765
+# a batch takes the jobs queued while the workers were busy, up to about this many lines
+SERVE_BATCH_MAX_LINES = 64
+# how long the batcher waits for more jobs after the first one, a little latency for fuller batches under load
+SERVE_BATCH_WAIT_SECONDS = 0.02
+# finished jobs kept for GET /jobs/<id>
+SERVE_JOB_HISTORY = 1000
+SOUND_SUBFOLDERS = ('quests', 'gossip')
+
+
+class SynthesisService:
+    """
+    Keeps the corpus, one synthesizer per worker thread and the voice latents in memory between requests, so
+    re-synthesizing a line only costs its inference. Jobs are queued and the batcher hands every job queued in the
+    meantime to the worker pool in one pass.
+    """
+
+    def __init__(self, locales, load_corpus, workers=STATIC_MAX_WORKERS):
+        self.locales = locales
+        self.load_corpus = load_corpus
+        self.processors = {locale: TTSProcessor(locale) for locale in locales}
+        self.corpus = load_corpus(locales)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='synthesis')
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.job_ids = itertools.count(1)
+        self.queued_lines = 0
+        self.running_lines = 0
+        self.stop_event = threading.Event()
+        self.batcher = threading.Thread(target=self.run_batches, name='batcher', daemon=True)
+        for processor in self.processors.values():
+            processor.create_output_dirs()
+
+    def warm_up(self):
+        """Loads a synthesizer on every worker thread and the latents of every voice of the corpus."""
+        from tts_cli.tts_ai import Converter
+        start = time.perf_counter()
+        # a worker blocked on the barrier cannot take a second task, so every thread loads its own model
+        barrier = threading.Barrier(self.workers)
+
+        def load(_):
+            barrier.wait()
+            return Converter().get_synthesizer()
+
+        list(self.executor.map(load, range(self.workers)))
+
+        voices = sorted({os.path.join(SOUND_INPUT_FOLDER, f"{race}-{gender}.ogg")
+                         for race, gender in self.corpus[['race', 'gender']].drop_duplicates().itertuples(index=False)
+                         if isinstance(race, str) and isinstance(gender, str)})
+        voices = [voice for voice in voices if os.path.isfile(voice)]
+        list(self.executor.map(lambda voice: Converter().get_speaker_name(Converter().get_synthesizer(), voice),
+                               voices))
+        print(f"Warmed up {self.workers} synthesizers and {len(voices)} voices in {time.perf_counter() - start:.1f}s")
+
+    def start(self):
+        self.batcher.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.batcher.join()
+        self.executor.shutdown()
+
+    def reload(self):
+        corpus = self.load_corpus(self.locales)
+        with self.lock:
+            self.corpus = corpus
+        return len(corpus)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'queued_lines': self.queued_lines,
+                'running_lines': self.running_lines,
+                'jobs': len(self.jobs),
+            }
+
+    def prepare_rows(self, locale, rows):
+        """Runs lines posted in the dataframe schema through preprocessing, race and gender may be given by name."""
+        df = pd.DataFrame(rows)
+        if 'text' not in df:
+            raise ValueError("Every row needs a text")
+        if 'DisplayRaceID' not in df:
+            df['DisplayRaceID'] = df['race'].map(RACE_DICT_INV) if 'race' in df else None
+        if 'DisplaySexID' not in df:
+            df['DisplaySexID'] = df['gender'].map(GENDER_DICT_INV) if 'gender' in df else None
+        if df['DisplayRaceID'].isna().any() or df['DisplaySexID'].isna().any():
+            raise ValueError(f"Every row needs a DisplayRaceID and DisplaySexID, or a race ({', '.join(RACE_DICT_INV)})"
+                             f" and gender ({', '.join(GENDER_DICT_INV)})")
+        defaults = {'original_text': df['text'], 'quest': '', 'source': 'gossip', 'quest_title': '', 'name': '',
+                    'type': 'creature', 'id': 0}
+        df = df.assign(**{column: value for column, value in defaults.items() if column not in df})
+        df = df.drop(columns=['race', 'gender'], errors='ignore').astype({'DisplayRaceID': int, 'DisplaySexID': int})
+        return self.processors[locale].preprocess_dataframe(df).assign(locale=locale)
+
+    def select_lines(self, request):
+        locale = request.get('locale', self.locales[0])
+        if locale not in self.processors:
+            raise ValueError(f"Locale {locale} is not served, start serve with --lang {locale}")
+        if 'rows' in request:
+            return self.prepare_rows(locale, request['rows'])
+        with self.lock:
+            corpus = self.corpus[self.corpus['locale'] == locale]
+        if 'quest' in request:
+            lines = corpus[corpus['quest'].astype(str) == str(request['quest'])]
+        elif 'id' in request:
+            lines = corpus[(corpus['quest'] == '') & (corpus['id'] == int(request['id']))]
+        else:
+            raise ValueError("Expected rows, a quest or a gossip id")
+        if lines.empty:
+            raise ValueError(f"No {locale} lines match {json.dumps(request)}")
+        return lines.reset_index(drop=True)
+
+    def submit(self, request):
+        lines = self.select_lines(request)
+        job = {
+            'id': next(self.job_ids),
+            'status': 'queued',
+            'locale': lines['locale'].iloc[0],
+            'lines': len(lines),
+            'force': bool(request.get('force', True)),
+            'submitted': time.time(),
+            'files': {},
+        }
+        with self.lock:
+            self.jobs[job['id']] = job
+            while len(self.jobs) > SERVE_JOB_HISTORY:
+                self.jobs.popitem(last=False)
+            self.queued_lines += len(lines)
+        self.queue.put((job, lines))
+        return self.get_job(job['id'])
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job = {**job, 'files': {key: dict(result) for key, result in job['files'].items()}}
+        for key, result in job['files'].items():
+            # failed lines and lines skipped for their text have no sound
+            if result['status'] == 'ok' or result.get('reason') == 'exists':
+                result['url'] = f"/audio/{job['locale']}/{key}"
+        return job
+
+    def run_batches(self):
+        while not self.stop_event.is_set():
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            lines = len(batch[0][1])
+            deadline = time.monotonic() + SERVE_BATCH_WAIT_SECONDS
+            while lines < SERVE_BATCH_MAX_LINES:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+                lines += len(batch[-1][1])
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        # lines writing the same file (the same gossip for several NPCs, the same line in several jobs) are
+        # synthesized once, concurrent writes to one file would corrupt it
+        lines = OrderedDict()
+        for job, df in batch:
+            for row_tuple in df.itertuples():
+                key = '/'.join(get_sound_file_path(row_tuple._asdict()))
+                lines.setdefault((row_tuple.locale, key), (row_tuple, []))[1].append(job)
+        with self.lock:
+            for job, df in batch:
+                job['status'] = 'running'
+                job['started'] = time.time()
+                self.queued_lines -= len(df)
+            self.running_lines += len(lines)
+
+        def run_line(item):
+            (locale, key), (row_tuple, jobs) = item
+            force = any(job['force'] for job in jobs)
+            try:
+                with metrics.row() as record:
+                    self.processors[locale].process_row(row_tuple, force_gen=force)
+            except Exception as e:
+                # metrics.row marked the row failed before re-raising, the batcher carries on
+                print(f"Error synthesizing {locale}/{key}: {e}")
+            result = {'status': record['status'], 'seconds': record['seconds']}
+            for field in ('reason', 'error'):
+                if field in record:
+                    result[field] = record[field]
+            with self.lock:
+                self.running_lines -= 1
+                for job in jobs:
+                    job['files'][key] = result
+
+        try:
+            list(self.executor.map(run_line, lines.items()))
+        finally:
+            finished = time.time()
+            with self.lock:
+                for job, df in batch:
+                    failed = any(result['status'] == 'failed' for result in job['files'].values())
+                    job['status'] = 'failed' if failed else 'done'
+                    job['queue_seconds'] = round(job['started'] - job['submitted'], 3)
+                    job['seconds'] = round(finished - job['submitted'], 3)
+            metrics.write_prometheus()
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /status                      queue depth and lines in flight
+    POST /jobs                        {"quest": 7} | {"id": 100} | {"rows": [...]}, optional "locale" and "force"
+    GET  /jobs/<id>                   status of a job and the URL of every sound it produced
+    GET  /audio/<locale>/<subfolder>/<file>
+    POST /reload                      re-query the corpus after fixing texts in the database
+    """
+    service = None
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}")
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        parts = path.split('/')[1:]
+        if path == '/status':
+            self.send_json(200, {**self.service.get_stats(), 'locales': self.service.locales,
+                                 'corpus_lines': len(self.service.corpus)})
+        elif len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+            job = self.service.get_job(int(parts[1]))
+            self.send_json(200, job) if job else self.send_json(404, {'error': f"No job {parts[1]}"})
+        elif len(parts) == 4 and parts[0] == 'audio':
+            self.send_audio(*parts[1:])
+        else:
+            self.send_json(404, {'error': f"Unknown path {path}"})
+
+    def send_audio(self, locale, subfolder, filename):
+        processor = self.service.processors.get(locale)
+        if processor is None or subfolder not in SOUND_SUBFOLDERS or filename in ('', '.', '..') or \
+                os.path.basename(filename) != filename:
+            self.send_json(404, {'error': "Unknown sound"})
+            return
+        path = os.path.join(processor.sound_output_folder, subfolder, filename)
+        if not os.path.isfile(path):
+            self.send_json(404, {'error': f"{subfolder}/{filename} was not generated"})
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        # the clips are WAV data whatever their extension, see audio_postprocess.encode_wav
+        self.send_header('Content-Type', 'audio/wav')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip('/')
+        try:
+            if path == '/jobs':
+                self.send_json(202, self.service.submit(self.read_json()))
+            elif path == '/reload':
+                self.send_json(200, {'corpus_lines': self.service.reload()})
+            else:
+                self.send_json(404, {'error': f"Unknown path {path}"})
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+
+
+def serve(locales, load_corpus, host=SERVE_HOST, port=SERVE_PORT, workers=STATIC_MAX_WORKERS, warm_up=True):
+    service = SynthesisService(locales, load_corpus, workers)
+    metrics.add_stats_source('serve', service.get_stats)
+    if warm_up:
+        service.warm_up()
+    service.start()
+
+    ServiceRequestHandler.service = service
+    server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    print(f"Serving {', '.join(locales)} ({len(service.corpus)} lines) on http://{host}:{port}, Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
@@ -0,0 +1,157 @@
+import os
+import json
+import hashlib
+from tts_cli.tts_utils import get_skip_reason, get_sound_file_path
+from tts_cli.length_table import load_sound_length_store, read_sound_length_from_header, record_sound_lengths, \
+    get_sound_store_key
+
+# next to the sounds folder of every locale tree, copied along with it from each node
+SHARD_MANIFEST_FOLDER = 'shards'
+
+
+def parse_shard(shard):
+    """Parses "i/N" (1 <= i <= N) into (i, N)."""
+    parts = shard.split("/")
+    if len(parts) != 2 or not all(part.strip().isdigit() for part in parts):
+        raise Exception(f"Invalid shard {shard}, expected i/N, e.g. 1/3")
+    index, count = int(parts[0]), int(parts[1])
+    if not 1 <= index <= count:
+        raise Exception(f"Invalid shard {shard}, i must be between 1 and N")
+    return index, count
+
+
+def get_sound_key(row):
+    return '/'.join(get_sound_file_path(row))
+
+
+def get_shard_of_key(locale, key, count):
+    # md5 rather than hash(), which is salted per process and would give every node a different partition
+    return int(hashlib.md5(f"{locale}/{key}".encode()).hexdigest()[:16], 16) % count + 1
+
+
+def get_expected_keys(df):
+    """{locale: set of sound keys} of the rows of df that get audio."""
+    expected = {}
+    for row in df.to_dict('records'):
+        if get_skip_reason(row) is None:
+            expected.setdefault(row['locale'], set()).add(get_sound_key(row))
+    return expected
+
+
+def get_corpus_fingerprint(keys, count):
+    return hashlib.sha256("\n".join([str(count), *sorted(keys)]).encode()).hexdigest()
+
+
+def select_shard(df, shard):
+    """
+    Rows of df whose sound file hashes into shard (i, N). Rows writing the same file always land on the same shard,
+    so nodes never write each other's files.
+    """
+    index, count = shard
+    keys = [get_sound_key(row) for row in df[['quest', 'source', 'templateText_race_gender_hash',
+                                              'player_gender']].to_dict('records')]
+    in_shard = [get_shard_of_key(locale, key, count) == index for locale, key in zip(df['locale'], keys)]
+    selected = df[in_shard].reset_index(drop=True)
+    print(f"Shard {index}/{count}: {len(selected)} of {len(df)} lines")
+    return selected
+
+
+def get_manifest_path(output_folder, index, count):
+    return os.path.join(output_folder, SHARD_MANIFEST_FOLDER, f"shard-{index}-of-{count}.json")
+
+
+def write_shard_manifests(processors, df, shard):
+    """
+    Writes, for every locale of the full (unsharded) corpus df, the manifest of this node's shard: the sound files
+    it had to produce and the length and size of those it did, plus a fingerprint of the whole corpus so merge can
+    tell manifests of different runs apart.
+    """
+    index, count = shard
+    for locale, keys in get_expected_keys(df).items():
+        processor = processors[locale]
+        store = load_sound_length_store(processor.sound_output_folder)
+        shard_keys = sorted(key for key in keys if get_shard_of_key(locale, key, count) == index)
+
+        files = {}
+        for key in shard_keys:
+            path = os.path.join(processor.sound_output_folder, key)
+            if not os.path.isfile(path):
+                continue
+            size = os.path.getsize(path)
+            entry = store.get(get_sound_store_key(processor.sound_output_folder, path))
+            length = entry['length'] if entry is not None and entry['size'] == size \
+                else read_sound_length_from_header(path)
+            files[key] = {'length': length, 'size': size}
+
+        manifest = {
+            'locale': locale,
+            'shard': index,
+            'shards': count,
+            'corpus': get_corpus_fingerprint(keys, count),
+            'expected': shard_keys,
+            'files': files,
+        }
+        path = get_manifest_path(processor.output_folder, index, count)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1, ensure_ascii=False)
+        print(f"{locale} shard {index}/{count}: {len(files)} of {len(shard_keys)} sounds, manifest written to {path}")
+
+
+def load_shard_manifests(output_folder):
+    folder = os.path.join(output_folder, SHARD_MANIFEST_FOLDER)
+    if not os.path.isdir(folder):
+        raise Exception(f"No shard manifests in {folder}, copy the {SHARD_MANIFEST_FOLDER} folder of every node there")
+    manifests = []
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(".json"):
+            with open(os.path.join(folder, filename), "r", encoding="utf-8") as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def merge_shards(processor):
+    """
+    Checks that the shard manifests copied into processor's tree cover one whole corpus, and that every sound they
+    list is present with its recorded size, then records the lengths of the union for the sound length table.
+    """
+    manifests = load_shard_manifests(processor.output_folder)
+    if not manifests:
+        raise Exception(f"No shard manifests found for {processor.locale}")
+
+    runs = {(manifest['shards'], manifest['corpus']) for manifest in manifests}
+    if len(runs) > 1:
+        raise Exception(f"{processor.locale}: the manifests come from {len(runs)} different runs (shard count or "
+                        f"corpus differ), regenerate the outdated shards")
+    count, corpus = runs.pop()
+    shards = sorted(manifest['shard'] for manifest in manifests)
+    missing_shards = sorted(set(range(1, count + 1)) - set(shards))
+    if missing_shards:
+        raise Exception(f"{processor.locale}: missing the manifests of shards {missing_shards} of {count}")
+
+    expected = set()
+    files = {}
+    for manifest in manifests:
+        expected.update(manifest['expected'])
+        files.update(manifest['files'])
+    if get_corpus_fingerprint(expected, count) != corpus:
+        raise Exception(f"{processor.locale}: the shards do not add up to the corpus they were cut from")
+
+    problems = []
+    for key in sorted(expected):
+        path = os.path.join(processor.sound_output_folder, key)
+        if key not in files:
+            problems.append(f"{key}: not generated")
+        elif not os.path.isfile(path):
+            problems.append(f"{key}: not copied to {processor.sound_output_folder}")
+        elif os.path.getsize(path) != files[key]['size']:
+            problems.append(f"{key}: size differs from its shard's manifest")
+    if problems:
+        raise Exception(f"{processor.locale}: {len(problems)} of {len(expected)} sounds are missing or differ:\n  " +
+                        "\n  ".join(problems[:20]) + ("\n  ..." if len(problems) > 20 else ""))
+
+    # each node only recorded its own sounds in its store, the union goes into the merged tree's store
+    record_sound_lengths(processor.sound_output_folder, [
+        (os.path.join(processor.sound_output_folder, key), files[key]['length'], files[key]['size'])
+        for key in sorted(expected) if files[key]['length'] is not None])
+    print(f"{processor.locale}: {count} shards merged, all {len(expected)} sounds present")
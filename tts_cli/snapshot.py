@@ -0,0 +1,248 @@
+import os
+import sqlite3
+import threading
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pymysql
+from tqdm import tqdm
+from tts_cli.env_vars import MYSQL_DATABASE, DB_BACKEND
+from tts_cli.sql_queries import connection_pool
+from tts_cli.init_db import EXPANSIONS, get_queried_tables, get_file_sha256, read_json, write_json, connect_for_import
+from tts_cli.sqlite_backend import convert_create_table, get_sqlite_path
+
+SNAPSHOT_DIR = "assets/sql/snapshot"
+SNAPSHOT_MANIFEST = "manifest.json"
+SNAPSHOT_SCHEMAS = [expansion['schema'] for expansion in EXPANSIONS.values()]
+SNAPSHOT_COMPRESSION = 'zstd'
+SNAPSHOT_ROW_GROUP_SIZE = 64 * 1024
+RESTORE_BATCH_ROWS = 5000
+DEFAULT_RESTORE_JOBS = 4
+
+
+def list_tables(db, schema):
+    """Returns {lowercase name: actual name} of the tables in schema, or None if the schema does not exist."""
+    if DB_BACKEND == 'sqlite':
+        if not os.path.isfile(get_sqlite_path(schema)):
+            return None
+        prefix = '' if schema == MYSQL_DATABASE else f'"{schema}".'
+        rows = db.execute(f"SELECT name FROM {prefix}sqlite_master WHERE type = 'table'").fetchall()
+    else:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s", (schema,))
+            rows = cursor.fetchall()
+        if not rows:
+            return None
+    return {name.lower(): name for name, in rows}
+
+
+def export_table(schema, table, path):
+    """Writes schema.table to a Parquet file and returns its manifest entry."""
+    with connection_pool.connection() as db:
+        if DB_BACKEND == 'sqlite':
+            prefix = '' if schema == MYSQL_DATABASE else f'"{schema}".'
+            cursor = db.execute(f'SELECT * FROM {prefix}"{table}"')
+            columns = [desc[0] for desc in cursor.description]
+            rows = cursor.fetchall()
+            create_table, = db.execute(f"SELECT sql FROM {prefix}sqlite_master WHERE type = 'table' AND name = ?",
+                                       (table,)).fetchone()
+            indexes = [sql for sql, in db.execute(f"SELECT sql FROM {prefix}sqlite_master "
+                                                   f"WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                                                   (table,))]
+        else:
+            with db.cursor() as cursor:
+                cursor.execute(f"SELECT * FROM `{schema}`.`{table}`")
+                columns = [desc[0] for desc in cursor.description]
+                rows = cursor.fetchall()
+                cursor.execute(f"SHOW CREATE TABLE `{schema}`.`{table}`")
+                create_table = cursor.fetchone()[1]
+            indexes = []
+
+    arrays = []
+    for values in zip(*rows) if rows else [[] for _ in columns]:
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # SQLite columns may mix types, keep those as text
+            arrays.append(pa.array([None if value is None else str(value) for value in values]))
+    data = pa.Table.from_arrays(arrays, names=columns)
+
+    part_path = path + ".part"
+    pq.write_table(data, part_path, compression=SNAPSHOT_COMPRESSION, row_group_size=SNAPSHOT_ROW_GROUP_SIZE)
+    os.replace(part_path, path)
+
+    return {
+        'schema': schema,
+        'table': table,
+        'file': os.path.basename(path),
+        'rows': len(rows),
+        'size': os.path.getsize(path),
+        'sha256': get_file_sha256(path),
+        'dialect': DB_BACKEND,
+        'create_table': create_table,
+        'indexes': indexes,
+        'columns': [{'name': field.name, 'type': str(field.type)} for field in data.schema],
+    }
+
+
+def snapshot_database(output_dir=SNAPSHOT_DIR):
+    """
+    Exports the tables read by the generator's queries from the configured backend to one Parquet file per table,
+    with a manifest holding their DDL, row counts and checksums.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    start_time = time.perf_counter()
+
+    tables = []
+    with connection_pool.connection() as db:
+        for schema in SNAPSHOT_SCHEMAS:
+            existing = list_tables(db, schema)
+            if existing is None:
+                print(f"Skipping schema {schema}: not found")
+                continue
+            for table in get_queried_tables(schema):
+                if table in existing:
+                    tables.append((schema, existing[table]))
+                else:
+                    print(f"Skipping {schema}.{table}: not found")
+
+    with ThreadPoolExecutor(max_workers=connection_pool.max_size) as executor:
+        futures = [executor.submit(export_table, schema, table, os.path.join(output_dir, f"{schema}.{table}.parquet"))
+                   for schema, table in tables]
+        entries = [future.result() for future in tqdm(futures, desc="Exporting tables", ncols=100)]
+
+    write_json(os.path.join(output_dir, SNAPSHOT_MANIFEST), {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'tables': entries,
+    })
+
+    total_rows = sum(entry['rows'] for entry in entries)
+    total_size = sum(entry['size'] for entry in entries)
+    print(f"Snapshot of {len(entries)} tables ({total_rows} rows, {total_size / 1024 ** 2:.1f} MB) written to "
+          f"{output_dir} in {time.perf_counter() - start_time:.1f}s")
+
+
+def get_mysql_column_type(arrow_type):
+    # arrow_type is the type name stored in the manifest, e.g. int64, double, decimal128(10, 2), string
+    if arrow_type.startswith(('int', 'uint')):
+        return 'BIGINT'
+    if arrow_type.startswith(('double', 'float', 'halffloat')):
+        return 'DOUBLE'
+    if arrow_type.startswith('decimal'):
+        return 'DECIMAL' + arrow_type[arrow_type.index('('):]
+    if arrow_type.startswith('timestamp'):
+        return 'DATETIME'
+    if arrow_type.startswith(('binary', 'large_binary')):
+        return 'LONGBLOB'
+    return 'LONGTEXT'
+
+
+def get_restore_ddl(entry, target):
+    """Returns (create table, create indexes) statements for the entry's table on the target backend."""
+    table = entry['table']
+    if target == 'sqlite':
+        if entry['dialect'] == 'sqlite':
+            return entry['create_table'], entry['indexes']
+        return convert_create_table(table, entry['create_table'])
+
+    if entry['dialect'] == 'mysql':
+        return entry['create_table'], []
+    # indexes of a SQLite snapshot are not carried over to MySQL
+    columns = ', '.join(f"`{column['name']}` {get_mysql_column_type(column['type'])}" for column in entry['columns'])
+    return f"CREATE TABLE `{table}` ({columns})", []
+
+
+def iter_parquet_rows(path):
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=RESTORE_BATCH_ROWS):
+        yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+
+def restore_table_to_mysql(entry, path, pbar):
+    create_table, _ = get_restore_ddl(entry, 'mysql')
+    db, cursor = connect_for_import(entry['schema'])
+    try:
+        cursor.execute("SET unique_checks = 0")
+        cursor.execute("SET foreign_key_checks = 0")
+        cursor.execute(f"DROP TABLE IF EXISTS `{entry['table']}`")
+        cursor.execute(create_table)
+        insert = f"INSERT INTO `{entry['table']}` VALUES ({', '.join(['%s'] * len(entry['columns']))})"
+        for rows in iter_parquet_rows(path):
+            cursor.executemany(insert, rows)
+            db.commit()
+            pbar.update(len(rows))
+    finally:
+        cursor.close()
+        db.close()
+
+
+def restore_table_to_sqlite(entry, path, pbar, connections, locks):
+    create_table, indexes = get_restore_ddl(entry, 'sqlite')
+    insert = f"INSERT INTO \"{entry['table']}\" VALUES ({', '.join('?' * len(entry['columns']))})"
+    # a SQLite file has a single writer, tables of the same schema take turns while decoding runs concurrently
+    db = connections[entry['schema']]
+    with locks[entry['schema']]:
+        db.execute(f"DROP TABLE IF EXISTS \"{entry['table']}\"")
+        db.execute(create_table)
+    for rows in iter_parquet_rows(path):
+        with locks[entry['schema']]:
+            db.executemany(insert, rows)
+        pbar.update(len(rows))
+    with locks[entry['schema']]:
+        for create_index in indexes:
+            db.execute(create_index)
+        db.commit()
+
+
+def restore_database(input_dir=SNAPSHOT_DIR, jobs=DEFAULT_RESTORE_JOBS):
+    """Loads a snapshot into the configured backend, restoring several tables at once."""
+    manifest = read_json(os.path.join(input_dir, SNAPSHOT_MANIFEST))
+    if manifest is None:
+        raise Exception(f"No snapshot manifest found in {input_dir}")
+    entries = manifest['tables']
+    start_time = time.perf_counter()
+
+    for entry in tqdm(entries, desc="Verifying snapshot", ncols=100):
+        if get_file_sha256(os.path.join(input_dir, entry['file'])) != entry['sha256']:
+            raise Exception(f"Snapshot file {entry['file']} does not match its manifest checksum")
+
+    schemas = sorted({entry['schema'] for entry in entries})
+    connections = {}
+    locks = {schema: threading.Lock() for schema in schemas}
+    if DB_BACKEND == 'sqlite':
+        for schema in schemas:
+            os.makedirs(os.path.dirname(get_sqlite_path(schema)), exist_ok=True)
+            connections[schema] = sqlite3.connect(get_sqlite_path(schema), check_same_thread=False)
+            connections[schema].execute("PRAGMA synchronous = OFF")
+    else:
+        db, cursor = connect_for_import()
+        for schema in schemas:
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{schema}`")
+        cursor.close()
+        db.close()
+
+    try:
+        with tqdm(total=sum(entry['rows'] for entry in entries), unit=' rows', desc=f'Restoring ({jobs} jobs)',
+                  ncols=100) as pbar, ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = []
+            for entry in entries:
+                path = os.path.join(input_dir, entry['file'])
+                if DB_BACKEND == 'sqlite':
+                    futures.append(executor.submit(restore_table_to_sqlite, entry, path, pbar, connections, locks))
+                else:
+                    futures.append(executor.submit(restore_table_to_mysql, entry, path, pbar))
+            for future in futures:
+                try:
+                    future.result()
+                except (pymysql.Error, sqlite3.Error) as e:
+                    raise Exception(f"Restoring the snapshot failed: {e}") from e
+        for db in connections.values():
+            db.execute("ANALYZE")
+            db.commit()
+    finally:
+        for db in connections.values():
+            db.close()
+
+    print(f"Restored {len(entries)} tables ({sum(entry['rows'] for entry in entries)} rows) from {input_dir} "
+          f"in {time.perf_counter() - start_time:.1f}s")
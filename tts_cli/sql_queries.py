@@ -1,21 +1,61 @@
 import pymysql
 import pandas as pd
-from tts_cli.env_vars import MYSQL_HOST, MYSQL_PORT, MYSQL_PASSWORD, MYSQL_USER, MYSQL_DATABASE
+from tts_cli.env_vars import MYSQL_HOST, MYSQL_PORT, MYSQL_PASSWORD, MYSQL_USER, MYSQL_DATABASE, DB_BACKEND
+from tts_cli.sqlite_backend import connect_sqlite, translate_query
+from tts_cli.db_pool import ConnectionPool
+from tts_cli.metrics import metrics
+
+# applied once per connection (and again by pymysql if ping() has to reconnect)
+QUERY_SESSION_SETTINGS = "SET SESSION sql_mode = 'ALLOW_INVALID_DATES,NO_ENGINE_SUBSTITUTION'"
 
 
 def make_connection():
+    if DB_BACKEND == 'sqlite':
+        return connect_sqlite()
     return pymysql.connect(
         host=MYSQL_HOST,
         port=MYSQL_PORT,
         user=MYSQL_USER,
         password=MYSQL_PASSWORD,
-        database=MYSQL_DATABASE
+        database=MYSQL_DATABASE,
+        charset='utf8mb4',
+        init_command=QUERY_SESSION_SETTINGS,
+        # pooled connections must not keep a read snapshot open between queries
+        autocommit=True
     )
 
 
-def query_dataframe_for_area(x_range, y_range, map_id):
-    db = make_connection()
-    sql_query = '''
+def ping_connection(db):
+    if DB_BACKEND == 'sqlite':
+        db.execute("SELECT 1")
+    else:
+        db.ping(reconnect=True)
+
+
+# shared by every query function, use `with connection_pool.connection() as db:`
+connection_pool = ConnectionPool(make_connection, ping_connection)
+metrics.add_stats_source('db_pool', connection_pool.get_stats)
+
+
+def query_dataframe(db, sql_query, params=None):
+    # queries are written for MySQL, the SQLite backend runs them through its dialect translation
+    if DB_BACKEND == 'sqlite':
+        sql_query = translate_query(sql_query)
+        params = params or ()
+
+    cursor = db.cursor()
+    try:
+        with metrics.stage('db_query'):
+            cursor.execute(sql_query, params)
+            data = cursor.fetchall()
+        columns = [desc[0] for desc in cursor.description]
+    finally:
+        cursor.close()
+
+    return pd.DataFrame(data, columns=columns)
+
+
+AREA_QUERY = '''
 WITH RECURSIVE
 filtered_creatures AS (
     SELECT *
@@ -134,23 +174,10 @@ WHERE
     (DisplaySexID = 0 AND bt.male_text IS NOT NULL AND bt.male_text != '')
     OR (DisplaySexID = 1 AND bt.female_text IS NOT NULL AND bt.female_text != '')
 ;
-    '''
-
-    with db.cursor() as cursor:
-        cursor.execute(
-            sql_query, (map_id, x_range[0], x_range[1], y_range[0], y_range[1]))
-        data = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-
-    db.close()
-    df = pd.DataFrame(data, columns=columns)
+'''
 
-    return df
 
-
-def query_dataframe_for_all_quests_and_gossip(lang: int = 0):
-    db = make_connection()
-    sql_query = '''
+ALL_QUESTS_AND_GOSSIP_QUERY = '''
 WITH RECURSIVE
 creature_quest_relations AS (
     SELECT 'accept' as source, qr.quest, ct.entry as creature_id
@@ -425,10 +452,10 @@ FROM gameobject_data
     JOIN quest_greeting qg ON qg.entry=gameobject_data.id AND type=1
 
 )
-    '''
+'''
 
-    if lang == 0:
-        sql_query += '''
+
+DEFAULT_LANGUAGE_SELECT = '''
 SELECT
     source,
     quest,
@@ -441,9 +468,11 @@ SELECT
     id,
     text as original_text
 FROM ALL_DATA
-        '''
-    else:
-        sql_query += f'''
+'''
+
+
+# {lang} is the locales_* column suffix of the client language
+LOCALIZED_SELECT = '''
 SELECT
     source,
     quest,
@@ -473,18 +502,55 @@ SELECT
 FROM ALL_DATA
     LEFT JOIN mangos.locales_quest          lq  ON lq .entry = quest
     LEFT JOIN mangos.locales_broadcast_text lbt ON lbt.entry = broadcast_text_id
-    LEFT JOIN mangos.locales_creature       lc  ON lc .entry = id AND type = 'creature'
-    LEFT JOIN mangos.locales_gameobject     lg  ON lg .entry = id AND type = 'gameobject'
-    LEFT JOIN mangos.locales_item           li  ON li .entry = id AND type = 'item'
+    LEFT JOIN mangos.locales_creature       lc  ON lc .entry = id AND ALL_DATA.type = 'creature'
+    LEFT JOIN mangos.locales_gameobject     lg  ON lg .entry = id AND ALL_DATA.type = 'gameobject'
+    LEFT JOIN mangos.locales_item           li  ON li .entry = id AND ALL_DATA.type = 'item'
     LEFT JOIN mangos.quest_greeting         qg  ON qg .entry = id AND qg.type = (CASE ALL_DATA.type WHEN 'creature' THEN 0 WHEN 'gameobject' THEN 1 ELSE -1 END)
-        '''
+'''
 
-    with db.cursor() as cursor:
-        cursor.execute(sql_query)
-        data = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
 
-    db.close()
-    df = pd.DataFrame(data, columns=columns)
+# spawn positions of the creatures starting or ending each zone's quests, ZoneOrSort <= 0 is a quest sort, not a zone
+QUEST_GIVER_POSITIONS_QUERY = '''
+SELECT qt.ZoneOrSort as area_id, c.map, c.position_x, c.position_y
+FROM quest_template qt
+    JOIN creature_questrelation qr ON qr.quest = qt.entry
+    JOIN creature c ON c.id = qr.id
+WHERE qt.ZoneOrSort > 0
+UNION ALL
+SELECT qt.ZoneOrSort as area_id, c.map, c.position_x, c.position_y
+FROM quest_template qt
+    JOIN creature_involvedrelation qr ON qr.quest = qt.entry
+    JOIN creature c ON c.id = qr.id
+WHERE qt.ZoneOrSort > 0
+'''
+
+
+AREA_NAMES_QUERY = '''
+SELECT entry as area_id, map_id, zone_id, name
+FROM area_template
+'''
+
+
+def query_dataframe_for_area(x_range, y_range, map_id):
+    with connection_pool.connection() as db:
+        return query_dataframe(db, AREA_QUERY, (map_id, x_range[0], x_range[1], y_range[0], y_range[1]))
+
+
+def query_dataframe_for_all_quests_and_gossip(lang: int = 0):
+    if lang == 0:
+        sql_query = ALL_QUESTS_AND_GOSSIP_QUERY + DEFAULT_LANGUAGE_SELECT
+    else:
+        sql_query = ALL_QUESTS_AND_GOSSIP_QUERY + LOCALIZED_SELECT.format(lang=lang)
+
+    with connection_pool.connection() as db:
+        return query_dataframe(db, sql_query)
+
+
+def query_dataframe_for_quest_giver_positions():
+    with connection_pool.connection() as db:
+        return query_dataframe(db, QUEST_GIVER_POSITIONS_QUERY)
+
 
-    return df
+def query_dataframe_for_area_names():
+    with connection_pool.connection() as db:
+        return query_dataframe(db, AREA_NAMES_QUERY)
@@ -0,0 +1,226 @@
+import mmap
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# offset and end are byte positions of the statement in its file, text has comments removed and /*!NNNNN ... */
+# version blocks unwrapped the way the server would for a recent enough version
+SqlStatement = namedtuple('SqlStatement', ['offset', 'end', 'text'])
+
+DEFAULT_DELIMITER = b';'
+DELIMITER_COMMAND = re.compile(rb'DELIMITER[ \t]+(\S+)[ \t]*(?:\r?\n|$)', re.IGNORECASE)
+WHITESPACE = re.compile(rb'\s*')
+VERSION_BLOCK_START = re.compile(rb'/\*!\d*')
+# inside quotes only the closing quote and backslash escapes matter
+QUOTE_SPECIALS = {
+    ord("'"): re.compile(rb"['\\]"),
+    ord('"'): re.compile(rb'["\\]'),
+    ord('`'): re.compile(rb'`'),
+}
+
+
+# table targeted by the usual dump statements, optionally schema-qualified and/or backtick-quoted
+STATEMENT_TABLE = re.compile(
+    r'^\s*(?:INSERT\s+(?:(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY)\s+)?(?:IGNORE\s+)?(?:INTO\s+)?'
+    r'|REPLACE\s+(?:(?:LOW_PRIORITY|DELAYED)\s+)?(?:INTO\s+)?|CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+    r'|DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?|ALTER\s+TABLE\s+|LOCK\s+TABLES\s+|TRUNCATE\s+(?:TABLE\s+)?'
+    r'|DELETE\s+(?:(?:LOW_PRIORITY|QUICK|IGNORE)\s+)*FROM\s+|UPDATE\s+(?:LOW_PRIORITY\s+)?(?:IGNORE\s+)?)'
+    r'(?:`?\w+`?\.)?`?(\w+)`?', re.IGNORECASE)
+
+# the rows of INSERT/REPLACE ... VALUES, the bulk of a dump, only touch their own table and are never scanned further
+SINGLE_TABLE_INSERT = re.compile(
+    r'^\s*(?:INSERT\s+(?:(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY)\s+)?(?:IGNORE\s+)?(?:INTO\s+)?'
+    r'|REPLACE\s+(?:(?:LOW_PRIORITY|DELAYED)\s+)?(?:INTO\s+)?)(?:`?\w+`?\.)?`?\w+`?\s*(?:\([^)]*\)\s*)?VALUES?\b',
+    re.IGNORECASE)
+QUOTED_TEXT = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`", re.DOTALL)
+# reads or references another table: subqueries, joins, INSERT ... SELECT, CREATE TABLE ... AS SELECT or LIKE,
+# foreign keys, renames, and the table lists of multi-table UPDATE and DELETE
+OTHER_TABLE_REFERENCE = re.compile(
+    r'\b(?:SELECT|JOIN|REFERENCES|RENAME)\b|^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?\S+\s*\(?\s*LIKE\b'
+    r'|^\s*(?:UPDATE|DELETE)\b[^=]*?,|^\s*DELETE\b.*?\bUSING\b', re.IGNORECASE | re.DOTALL)
+
+# objects that may reference any table, created once every table is loaded
+DEFERRED_STATEMENT = re.compile(
+    r'^\s*CREATE\s+(?:OR\s+REPLACE\s+)?(?:ALGORITHM\s*=\s*\w+\s+)?(?:DEFINER\s*=\s*\S+\s+)?'
+    r'(?:SQL\s+SECURITY\s+\w+\s+)?(?:VIEW|TRIGGER|PROCEDURE|FUNCTION|EVENT)\b', re.IGNORECASE)
+
+# tables read by a SELECT, optionally schema-qualified, and the common table expressions it defines
+QUERY_TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+(?:(\w+)\s*\.\s*)?(\w+)', re.IGNORECASE)
+QUERY_CTE_DEFINITION = re.compile(r'\b(\w+)\s*(?:\([\w\s,]*\))?\s+AS\s*\(', re.IGNORECASE)
+QUERY_LINE_COMMENT = re.compile(r'--[^\n]*')
+
+
+def get_statement_table(text):
+    match = STATEMENT_TABLE.match(text)
+    return match.group(1) if match else None
+
+
+def is_multi_table_statement(text):
+    """True when a statement routed by its table also reads or references another one."""
+    if SINGLE_TABLE_INSERT.match(text):
+        return False
+    return OTHER_TABLE_REFERENCE.search(QUOTED_TEXT.sub(' _ ', text)) is not None
+
+
+def get_query_tables(sql, default_schema):
+    """Returns {schema: set of lowercase table names} read by a query, leaving out its common table expressions."""
+    sql = QUERY_LINE_COMMENT.sub('', sql)
+    ctes = {name.lower() for name in QUERY_CTE_DEFINITION.findall(sql)}
+    tables = {}
+    for schema, table in QUERY_TABLE_REFERENCE.findall(sql):
+        if not schema and table.lower() in ctes:
+            continue
+        tables.setdefault((schema or default_schema).lower(), set()).add(table.lower())
+    return tables
+
+
+class TableAllowList:
+    """
+    Decides which dump statements to skip when only some tables are wanted, and counts what was skipped.
+    Statements without a table (SET...) are kept. Views, triggers and routines are dropped since they may
+    reference tables that are not imported.
+    """
+
+    def __init__(self, tables):
+        self.tables = {table.lower() for table in tables}
+        self.skipped_statements = 0
+        self.skipped_bytes = 0
+        self.skipped_tables = set()
+
+    def skips(self, text, size):
+        if DEFERRED_STATEMENT.match(text):
+            table = '<views, triggers and routines>'
+        else:
+            table = get_statement_table(text)
+            if table is None or table.lower() in self.tables:
+                return False
+        self.skipped_statements += 1
+        self.skipped_bytes += size
+        self.skipped_tables.add(table.lower())
+        return True
+
+    def print_report(self, imported_bytes, elapsed):
+        # time saved is estimated at the throughput measured on the statements that were imported
+        seconds_saved = self.skipped_bytes * elapsed / imported_bytes if imported_bytes else 0.0
+        print(f"Skipped {self.skipped_statements} statements ({self.skipped_bytes / 1024 ** 2:.1f} MB) for "
+              f"{len(self.skipped_tables)} tables outside the allow-list of {len(self.tables)} tables, "
+              f"saving about {seconds_saved:.1f}s of import time")
+
+
+class SqlStatementError(Exception):
+    def __init__(self, path, offset, message):
+        super().__init__(f"{path} at byte {offset}: {message}")
+        self.path = path
+        self.offset = offset
+
+
+@lru_cache(maxsize=None)
+def get_specials_pattern(delimiter, in_version_block):
+    specials = [rb"['\"`#]", rb'--(?=\s)', rb'/\*', re.escape(delimiter)]
+    if in_version_block:
+        specials.append(rb'\*/')
+    return re.compile(b'|'.join(specials))
+
+
+def find_quote_end(data, quote_start, path):
+    quote = data[quote_start]
+    pattern = QUOTE_SPECIALS[quote]
+    pos = quote_start + 1
+    while True:
+        match = pattern.search(data, pos)
+        if match is None:
+            raise SqlStatementError(path, quote_start, "unterminated quoted string")
+        pos = match.start()
+        if data[pos] == ord('\\'):
+            pos += 2
+        elif pos + 1 < len(data) and data[pos + 1] == quote:
+            pos += 2  # doubled quote
+        else:
+            return pos + 1
+
+
+def split_sql_statements(data, path='<sql>'):
+    """
+    Splits a buffer (bytes or mmap) of MySQL statements, understanding quotes, backslash escapes, comments,
+    /*!NNNNN ... */ version blocks and DELIMITER commands. Statements are sliced out of the buffer once, so the
+    cost stays linear in the input size.
+    """
+    size = len(data)
+    delimiter = DEFAULT_DELIMITER
+    pos = 0
+
+    while pos < size:
+        pos = WHITESPACE.match(data, pos).end()
+        if pos >= size:
+            return
+
+        # DELIMITER is a client command, only valid at the start of a statement
+        match = DELIMITER_COMMAND.match(data, pos)
+        if match:
+            delimiter = match.group(1)
+            pos = match.end()
+            continue
+
+        statement_start = pos
+        segments = []
+        segment_start = pos
+        in_version_block = False
+        specials = get_specials_pattern(delimiter, in_version_block)
+
+        while True:
+            match = specials.search(data, pos)
+            if match is None:
+                segments.append(data[segment_start:size])
+                pos = statement_end = size
+                break
+
+            token = match.group()
+            pos = match.start()
+            if token == delimiter:
+                segments.append(data[segment_start:pos])
+                statement_end = pos + len(delimiter)
+                pos = statement_end
+                break
+            elif token in (b"'", b'"', b'`'):
+                pos = find_quote_end(data, pos, path)
+            elif token == b'#' or token == b'--':
+                # comments and version block markers separate tokens like whitespace does
+                segments.extend((data[segment_start:pos], b' '))
+                line_end = data.find(b'\n', pos)
+                pos = segment_start = size if line_end < 0 else line_end + 1
+            elif token == b'*/':
+                segments.extend((data[segment_start:pos], b' '))
+                pos = segment_start = pos + 2
+                in_version_block = False
+                specials = get_specials_pattern(delimiter, in_version_block)
+            else:  # /*
+                segments.extend((data[segment_start:pos], b' '))
+                version_match = VERSION_BLOCK_START.match(data, pos)
+                if version_match and not in_version_block:
+                    pos = segment_start = version_match.end()
+                    in_version_block = True
+                    specials = get_specials_pattern(delimiter, in_version_block)
+                else:
+                    comment_end = data.find(b'*/', pos + 2)
+                    if comment_end < 0:
+                        raise SqlStatementError(path, pos, "unterminated comment")
+                    pos = segment_start = comment_end + 2
+
+        text = b''.join(segments).strip()
+        if text:
+            try:
+                text = text.decode('utf-8')
+            except UnicodeDecodeError as e:
+                raise SqlStatementError(path, statement_start, f"invalid UTF-8: {e}") from e
+            yield SqlStatement(statement_start, statement_end, text)
+
+
+def iter_sql_statements(path):
+    """Yields the statements of a SQL file, reading it through a memory map."""
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return
+        with data:
+            yield from split_sql_statements(data, path)
@@ -0,0 +1,244 @@
+import os
+import re
+import sqlite3
+import time
+from tqdm import tqdm
+from tts_cli.env_vars import MYSQL_DATABASE, SQLITE_FOLDER
+from tts_cli.sql_splitter import iter_sql_statements, get_statement_table, SqlStatementError
+
+SQLITE_COMMIT_EVERY = 1000
+
+INSERT_STATEMENT = re.compile(
+    r'^\s*(INSERT|REPLACE)\s+(IGNORE\s+)?(?:INTO\s+)?(?:`?\w+`?\.)?`?(\w+)`?\s*(\([^)]*\))?\s*VALUES\s*',
+    re.IGNORECASE)
+MYSQL_VALUE_TOKEN = re.compile(r"""\s*(?:
+    '((?:[^'\\]+|\\.|'')*)'
+    |"((?:[^"\\]+|\\.|"")*)"
+    |(NULL)\b
+    |0x([0-9A-Fa-f]*)
+    |([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |([(),;])
+)""", re.VERBOSE | re.DOTALL | re.IGNORECASE)
+MYSQL_ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a', '%': '\\%', '_': '\\_'}
+MYSQL_ESCAPE = re.compile(r"\\(.)|''|\"\"", re.DOTALL)
+
+INDEX_DEFINITION = re.compile(
+    r'^(?:(UNIQUE)\s+)?(?:FULLTEXT\s+|SPATIAL\s+)?(?:KEY|INDEX)\s*`?(\w*)`?\s*(?:USING\s+\w+\s*)?\((.*)\)', re.IGNORECASE)
+PRIMARY_KEY_DEFINITION = re.compile(r'^PRIMARY\s+KEY\s*(?:USING\s+\w+\s*)?\((.*)\)', re.IGNORECASE)
+COLUMN_DEFINITION = re.compile(r'^`?(\w+)`?\s+(\w+)', re.IGNORECASE)
+KEY_PART_LENGTH = re.compile(r'\(\d+\)')
+
+# MySQL query syntax rewritten for SQLite by translate_query
+QUERY_REWRITES = [
+    (re.compile(r'\bUNION\s+DISTINCT\b', re.IGNORECASE), 'UNION'),
+    (re.compile(r'\bIF\s*\(', re.IGNORECASE), 'IIF('),
+    (re.compile(rf'\b{MYSQL_DATABASE}\s*\.\s*', re.IGNORECASE), ''),
+    (re.compile(r'%s'), '?'),
+]
+
+
+def get_sqlite_path(schema=MYSQL_DATABASE):
+    return os.path.join(SQLITE_FOLDER, f"{schema}.sqlite3")
+
+
+def get_sqlite_type(mysql_type):
+    mysql_type = mysql_type.lower()
+    if 'int' in mysql_type or mysql_type in ('bit', 'bool', 'boolean'):
+        return 'INTEGER'
+    if mysql_type in ('float', 'double', 'real', 'decimal', 'numeric'):
+        return 'REAL'
+    if 'blob' in mysql_type or 'binary' in mysql_type:
+        return 'BLOB'
+    return 'TEXT'
+
+
+def split_top_level(text):
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"`':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return [part for part in parts if part]
+
+
+def convert_create_table(table, text):
+    """Returns the SQLite CREATE TABLE statement and the CREATE INDEX statements for a MySQL CREATE TABLE."""
+    body = text[text.index('(') + 1:text.rindex(')')]
+    columns = []
+    indexes = []
+
+    for definition in split_top_level(body):
+        if match := PRIMARY_KEY_DEFINITION.match(definition):
+            columns.append(f"PRIMARY KEY ({KEY_PART_LENGTH.sub('', match.group(1))})")
+        elif match := INDEX_DEFINITION.match(definition):
+            unique, name, key_parts = match.groups()
+            indexes.append(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS "{table}_{name or len(indexes)}" '
+                           f'ON "{table}" ({KEY_PART_LENGTH.sub("", key_parts)})')
+        elif re.match(r'^(?:CONSTRAINT|FOREIGN\s+KEY|CHECK)\b', definition, re.IGNORECASE):
+            continue
+        elif match := COLUMN_DEFINITION.match(definition):
+            name, mysql_type = match.groups()
+            inline_primary_key = ' PRIMARY KEY' if re.search(r'\bPRIMARY\s+KEY\b', definition, re.IGNORECASE) else ''
+            columns.append(f'"{name}" {get_sqlite_type(mysql_type)}{inline_primary_key}')
+
+    return f'CREATE TABLE "{table}" ({", ".join(columns)})', indexes
+
+
+def unescape_mysql_string(value):
+    def replace(match):
+        if match.group(1) is None:
+            return match.group()[0]
+        return MYSQL_ESCAPES.get(match.group(1), match.group(1))
+    return MYSQL_ESCAPE.sub(replace, value)
+
+
+def parse_insert_values(text, pos):
+    """Parses the (...), (...) tuples of a MySQL extended INSERT into Python rows."""
+    rows = []
+    row = None
+    while True:
+        match = MYSQL_VALUE_TOKEN.match(text, pos)
+        if match is None:
+            if text[pos:].strip():
+                raise ValueError(f"unexpected value syntax: {text[pos:pos + 40]!r}")
+            return rows
+        pos = match.end()
+        single_quoted, double_quoted, null, hex_value, number, punctuation = match.groups()
+        if punctuation == '(':
+            row = []
+        elif punctuation == ')':
+            rows.append(tuple(row))
+            row = None
+        elif punctuation in (',', ';'):
+            continue
+        elif single_quoted is not None:
+            row.append(unescape_mysql_string(single_quoted))
+        elif double_quoted is not None:
+            row.append(unescape_mysql_string(double_quoted))
+        elif null is not None:
+            row.append(None)
+        elif hex_value is not None:
+            row.append(bytes.fromhex(hex_value))
+        elif re.fullmatch(r'[-+]?\d+', number):
+            row.append(int(number))
+        else:
+            row.append(float(number))
+
+
+def convert_insert(text):
+    match = INSERT_STATEMENT.match(text)
+    if match is None:
+        return None, None, []
+    verb, ignore, table, column_list = match.groups()
+    rows = parse_insert_values(text, match.end())
+    if not rows:
+        return table, None, []
+
+    conflict = ' OR REPLACE' if verb.upper() == 'REPLACE' else ' OR IGNORE' if ignore else ''
+    columns = ' ' + column_list.replace('`', '"') if column_list else ''
+    placeholders = ', '.join('?' * len(rows[0]))
+    return table, f'INSERT{conflict} INTO "{table}"{columns} VALUES ({placeholders})', rows
+
+
+def import_sql_files_to_sqlite(sql_files, path, allow_list=None):
+    """
+    Streams MySQL dump files into an embedded SQLite database, keeping only the tables of the allow-list if given.
+    Indexes are created once the data is loaded.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+
+    indexes = []
+    statements = 0
+    imported_bytes = 0
+    pending = 0
+    start_time = time.perf_counter()
+
+    with tqdm(total=sum(map(os.path.getsize, sql_files)), unit='B', unit_scale=True, unit_divisor=1024,
+              desc=f'Importing into {os.path.basename(path)}', ncols=100) as pbar:
+        for file in sql_files:
+            position = 0
+            for statement in iter_sql_statements(file):
+                size = statement.end - position
+                pbar.update(size)
+                position = statement.end
+
+                if allow_list is not None and allow_list.skips(statement.text, size):
+                    continue
+                table = get_statement_table(statement.text)
+                if table is None:
+                    continue
+
+                keyword = statement.text.lstrip()[:6].upper()
+                try:
+                    if keyword == 'DROP T':
+                        db.execute(f'DROP TABLE IF EXISTS "{table}"')
+                    elif keyword == 'CREATE':
+                        create_table, table_indexes = convert_create_table(table, statement.text)
+                        db.execute(create_table)
+                        indexes.extend(table_indexes)
+                    elif keyword in ('INSERT', 'REPLAC'):
+                        _, insert, rows = convert_insert(statement.text)
+                        if insert:
+                            db.executemany(insert, rows)
+                    else:
+                        continue  # LOCK TABLES, ALTER TABLE ... DISABLE KEYS...
+                except (sqlite3.Error, ValueError) as e:
+                    raise SqlStatementError(file, statement.offset, e) from e
+
+                statements += 1
+                imported_bytes += size
+                pending += 1
+                if pending >= SQLITE_COMMIT_EVERY:
+                    db.commit()
+                    pending = 0
+            pbar.update(os.path.getsize(file) - position)
+
+    db.commit()
+    for create_index in tqdm(indexes, desc='Creating indexes', ncols=100):
+        db.execute(create_index)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("ANALYZE")
+    db.commit()
+    db.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Imported {statements} statements ({imported_bytes / 1024 ** 2:.1f} MB) into {path} in {elapsed:.1f}s")
+    if allow_list is not None:
+        allow_list.print_report(imported_bytes, elapsed)
+    return statements, imported_bytes
+
+
+def translate_query(sql):
+    for pattern, replacement in QUERY_REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def connect_sqlite():
+    path = get_sqlite_path()
+    if not os.path.isfile(path):
+        raise Exception(f"SQLite database {path} not found, run init-db with DB_BACKEND=sqlite first")
+
+    db = sqlite3.connect(path, check_same_thread=False)
+    # other schemas (e.g. mangos_wrath) are attached under their MySQL name so qualified table names keep working
+    for filename in sorted(os.listdir(SQLITE_FOLDER)):
+        schema, extension = os.path.splitext(filename)
+        if extension == '.sqlite3' and schema != MYSQL_DATABASE:
+            db.execute("ATTACH DATABASE ? AS ?", (os.path.join(SQLITE_FOLDER, filename), schema))
+    return db
@@ -1,12 +1,16 @@
 import threading
 import os
+import time
 from TTS.utils.manage import ModelManager
 from TTS.utils.synthesizer import Synthesizer
 from tqdm import tqdm
 import numpy as np
-import torch
-import librosa
-from fairseq import checkpoint_utils
+import torch.multiprocessing as mp
+from tts_cli.metrics import metrics
+from tts_cli.profiling import torch_profile
+from tts_cli.audio_postprocess import postprocess, encode_wav, postprocess_totals
+
+mp.set_start_method('spawn', force=True)
 
 models_path = os.getenv("TTS_MODELS_JSON_PATH")
 assets_path = os.getenv("ASSETS_PATH")
@@ -14,25 +18,27 @@ assets_path = os.getenv("ASSETS_PATH")
 # print(f"tts models path is located at {models_path}")
 # print(f"tts assets path is located at {assets_path}")
 
-model_manager = ModelManager(models_path, output_prefix=assets_path)
 tts_model_name = "tts_models/multilingual/multi-dataset/xtts_v2"
 
-tts_model_path = assets_path + 'tts/' + tts_model_name.replace("/", "--")
-
-# downloads model if not exists in assets - this condition delays starting TTS for efficiency if model is already downloaded
-if not os.path.exists(tts_model_path):
-    tts_model_path, _, model_item = model_manager.download_model("tts_models/multilingual/multi-dataset/xtts_v2")
-
 RECREATION_REQUIRED = False
 
 
 lock = threading.Lock()
+_tts_model_path = None
 
-syn = Synthesizer(
-    tts_checkpoint=tts_model_path,
-    tts_config_path=os.path.join(tts_model_path, "config.json"),
-    use_cuda=True,
-)
+
+def get_tts_model_path():
+    """Returns the local xtts_v2 folder, downloading the model the first time it is needed."""
+    global _tts_model_path
+    with lock:
+        if _tts_model_path is None:
+            tts_model_path = assets_path + 'tts/' + tts_model_name.replace("/", "--")
+            # downloads model if not exists in assets - this condition delays starting TTS for efficiency if model is already downloaded
+            if not os.path.exists(tts_model_path):
+                model_manager = ModelManager(models_path, output_prefix=assets_path)
+                tts_model_path, _, model_item = model_manager.download_model(tts_model_name)
+            _tts_model_path = tts_model_path
+        return _tts_model_path
 
 
 class Singleton(type):
@@ -53,40 +59,99 @@ class Converter(metaclass=Singleton):
         self.tqdm_bar_format = "{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}] {postfix}"
         self.tqdm = None
         self.failed_inputs = np.empty((0,), dtype=object)
-        
+        # XTTS keeps per-call state on the model during inference, so every worker thread gets its own synthesizer
+        self.local = threading.local()
+        self.speaker_lock = threading.Lock()
+        # voice sample path: (gpt_cond_latent, speaker_embedding), shared by every thread and locale
+        self.speaker_latents = {}
+
+    def get_synthesizer(self):
+        syn = getattr(self.local, 'syn', None)
+        if syn is None:
+            tts_model_path = get_tts_model_path()
+            with metrics.stage('model_load'):
+                syn = Synthesizer(
+                    tts_checkpoint=tts_model_path,
+                    tts_config_path=os.path.join(tts_model_path, "config.json"),
+                    use_cuda=True,
+                )
+            self.local.syn = syn
+        return syn
+
+    def get_speaker_name(self, syn, speaker_wav):
+        """
+        Registers the conditioning latents of a voice sample as an XTTS speaker of syn, computing them only the first
+        time the voice is used. Returns None if the model has no speaker manager to register them with.
+        """
+        speaker_manager = getattr(syn.tts_model, 'speaker_manager', None)
+        if speaker_manager is None:
+            return None
+        with self.speaker_lock:
+            latents = self.speaker_latents.get(speaker_wav)
+            if latents is None:
+                config = syn.tts_config
+                with metrics.stage('speaker_latents'):
+                    latents = syn.tts_model.get_conditioning_latents(
+                        audio_path=[speaker_wav],
+                        gpt_cond_len=config.gpt_cond_len,
+                        gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+                        max_ref_length=config.max_ref_len,
+                        sound_norm_refs=config.sound_norm_refs,
+                    )
+                self.speaker_latents[speaker_wav] = latents
+        # synthesize() unpacks the speaker's values in this order
+        gpt_cond_latent, speaker_embedding = latents
+        speaker_manager.speakers[speaker_wav] = {'gpt_cond_latent': gpt_cond_latent,
+                                                 'speaker_embedding': speaker_embedding}
+        return speaker_wav
+
     def convert(self, text, input_sound_path, output_sound_path, language):
         # print(f"text: {text}")
         print(f"input: {input_sound_path}")
         print(f"output: {output_sound_path}")
 
         try:
-            syn = Synthesizer(
-                tts_checkpoint=tts_model_path,
-                tts_config_path=os.path.join(tts_model_path, "config.json"),
-                use_cuda=True,
-            )
-            outputs = syn.tts(
-                text=text,
-                speaker_name=None,
-                language_name=language,
-                speaker_wav=input_sound_path,
-                reference_wav=None,
-                style_wav=None,
-                style_text=None,
-                reference_speaker_name=None,
-                split_sentences=True,
-            )
-
-            return syn.save_wav(outputs, output_sound_path)
+            syn = self.get_synthesizer()
+            speaker_name = self.get_speaker_name(syn, input_sound_path)
+            with metrics.stage('model_inference'), torch_profile('syn.tts'):
+                outputs = syn.tts(
+                    text=text,
+                    speaker_name=speaker_name,
+                    language_name=language,
+                    speaker_wav=None if speaker_name else input_sound_path,
+                    reference_wav=None,
+                    style_wav=None,
+                    style_text=None,
+                    reference_speaker_name=None,
+                    split_sentences=True,
+                )
+
+            with metrics.stage('postprocess'):
+                samples, stats = postprocess(outputs, syn.output_sample_rate)
+            postprocess_totals.add(stats)
+            # encoded in memory first so encoding and disk time are told apart
+            with metrics.stage('encode'):
+                buffer = encode_wav(samples, syn.output_sample_rate)
+            with metrics.stage('disk_write'):
+                with open(output_sound_path, "wb") as f:
+                    f.write(buffer.getbuffer())
+
+            # duration is known exactly from the sample count, no need to re-open the file later
+            length = len(samples) / syn.output_sample_rate
+            metrics.annotate(audio_seconds=round(length, 3),
+                             removed_seconds=round(stats['trimmed_seconds'] + stats['gap_seconds'], 3),
+                             gain_db=round(stats['gain_db'], 2))
+            return length
 
         except Exception as e:
             print(f"Error in conversion: {str(e)}")
             self.failed_inputs = np.append(self.failed_inputs, input_sound_path)
+            metrics.annotate(status='failed', reason=type(e).__name__, error=str(e))
             return None
 
     def generate_chunks(self, df):
         # Adjust this value based on your system's capabilities
-        chunk_size = int(df.shape[0] / 5)
+        chunk_size = max(int(df.shape[0] / 5), 1)
         for i in range(0, df.shape[0], chunk_size):
             yield df.iloc[df.index[i: i + chunk_size]]
 
@@ -107,9 +172,16 @@ class Converter(metaclass=Singleton):
 
         chunks = self.generate_chunks(df)
 
+        def run_row(item):
+            submitted, row = item
+            with metrics.row():
+                metrics.observe('queue_wait', time.perf_counter() - submitted)
+                return row_proccesing_fn(row)
+
         for chunk in chunks:
+            # rows are submitted as the generator is consumed, the time until a worker picks one up is queue wait
             for custom_message in zip(
-                executor.map(row_proccesing_fn, chunk.itertuples())
+                executor.map(run_row, ((time.perf_counter(), row) for row in chunk.itertuples()))
             ):
                 self.tqdm.set_postfix_str(custom_message)
                 self.tqdm.update(1)
@@ -1,18 +1,17 @@
 from slpp import slpp as lua
-from tts_cli.utils import get_first_n_words, get_last_n_words, replace_dollar_bs_with_space
-from tts_cli.length_table import write_sound_length_table_lua
+from tts_cli.utils import get_first_n_words, get_last_n_words, replace_dollar_bs_with_space, sort_lua_table, write_file_if_changed, \
+    language_code_to_tts_language
+from tts_cli.length_table import write_sound_length_table_lua, record_sound_length
 from tts_cli.consts import RACE_DICT, GENDER_DICT
+from tts_cli.fuzzy_search import tokenize, jaccard_similarity
 from tts_cli.env_vars import ELEVENLABS_API_KEY
+from tts_cli.metrics import metrics
 import os
 import pandas as pd
 from tqdm import tqdm
 import hashlib
 from concurrent.futures import ThreadPoolExecutor
 import re
-import torch.multiprocessing as mp
-
-from tts_cli.tts_ai import Converter
-mp.set_start_method('spawn', force=True)
 
 
 # TODO: make module name a cli arg when we do other expansions
@@ -20,6 +19,10 @@ MODULE_NAME = 'AI_VoiceOverData_Vanilla'
 
 STATIC_MAX_WORKERS = 2
 
+# gossip lookup keys never get shorter than this many words from each end of the text, to leave the addon's
+# fuzzy search some slack for text rendered in game (player names, races...)
+GOSSIP_KEY_MIN_WORDS = 5
+
 INPUT_FOLDER = 'translator/assets'
 # OUTPUT_FOLDER = 'translator/assets/wow-classic-fr/AI_VoiceOverData_Vanilla/generated'
 OUTPUT_FOLDER = 'translator/assets/wow-classic-test/generated'
@@ -28,18 +31,63 @@ DEFAULT_VOICE = 'translator/assets/sounds/default/medivh.mp3'
 RVC_INPUT_FOLDER = INPUT_FOLDER + '/rvc_models'
 SOUND_INPUT_FOLDER = INPUT_FOLDER + '/voices'
 SOUND_OUTPUT_FOLDER = OUTPUT_FOLDER + '/sounds'
+DEFAULT_LOCALE = 'frFR'
 DATAMODULE_TABLE_GUARD_CLAUSE = 'if not VoiceOver or not VoiceOver.DataModules then return end'
 REPLACE_DICT = {'$b': '\n', '$B': '\n', '$n': 'aventurier', '$N': 'Aventurier',
                 '$C': 'Aventurier', '$c': 'aventurier', '$R': 'Voyageur', '$r': 'voyageur'}
 
 
+BASE62_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+# 8 base-62 digits keep ~47 bits of the md5, plenty for the corpus size while saving 24 bytes per occurrence
+SHORT_HASH_LENGTH = 8
+
+
 def get_hash(text):
     hash_object = hashlib.md5(text.encode())
     return hash_object.hexdigest()
 
 
-def create_output_subdirs(subdir: str):
-    output_subdir = os.path.join(SOUND_OUTPUT_FOLDER, subdir)
+def get_short_hash(hex_digest, length=SHORT_HASH_LENGTH):
+    value = int(hex_digest, 16)
+    digits = []
+    for _ in range(length):
+        value, remainder = divmod(value, 62)
+        digits.append(BASE62_ALPHABET[remainder])
+    return ''.join(digits)
+
+
+def shorten_hashes(hashes, texts):
+    """
+    Maps every md5 hex digest to its truncated base-62 form, raising if two different digests of the corpus
+    end up with the same short ID. Short IDs are compared case-insensitively because they become file names,
+    and the game mostly runs on case-insensitive file systems.
+    """
+    short_ids = {}
+    owners = {}
+    for full_hash, text in zip(hashes, texts):
+        if full_hash in short_ids:
+            continue
+        short_id = get_short_hash(full_hash)
+        owner = owners.setdefault(short_id.lower(), (full_hash, text))
+        if owner[0] != full_hash:
+            raise Exception(f"Short hash collision on '{short_id}' between {owner[1]!r} and {text!r}, "
+                            f"increase SHORT_HASH_LENGTH")
+        short_ids[full_hash] = short_id
+
+    return [short_ids[full_hash] for full_hash in hashes]
+
+
+def get_output_folder(locale: str):
+    # the frFR tree predates multi-locale runs and keeps its place, every other locale gets a sibling tree
+    return OUTPUT_FOLDER if locale == DEFAULT_LOCALE else f"{OUTPUT_FOLDER}-{locale}"
+
+
+def get_sound_output_folder(locale: str):
+    return get_output_folder(locale) + '/sounds'
+
+
+def create_output_subdirs(sound_output_folder: str, subdir: str):
+    output_subdir = os.path.join(sound_output_folder, subdir)
     if not os.path.exists(output_subdir):
         os.makedirs(output_subdir)
 
@@ -79,26 +127,136 @@ def prune_quest_id_table(quest_id_table):
     return pruned_table
 
 
+def get_gossip_text_key(text, n):
+    words = re.findall(r'\S+', text)
+    if len(words) <= 2 * n:
+        return ' '.join(words)
+    return get_first_n_words(text, n) + ' ' + get_last_n_words(text, n)
+
+
+def resolves_to_own_hash(query_tokens, key_tokens, hashes):
+    for i, tokens in enumerate(query_tokens):
+        own_similarity = jaccard_similarity(tokens, key_tokens[i])
+        for j, other_tokens in enumerate(key_tokens):
+            if hashes[j] != hashes[i] and not jaccard_similarity(tokens, other_tokens) < own_similarity:
+                return False
+    return True
+
+
+def compact_gossip_text_keys(text_table):
+    """
+    Replaces the full gossip texts of one NPC by their first and last N words, N being the smallest value
+    (but at least GOSSIP_KEY_MIN_WORDS) for which every full text still fuzzy-matches its own hash strictly
+    better than any other entry. Falls back to the full texts when no such N exists.
+    """
+    texts = list(text_table)
+    hashes = [text_table[text] for text in texts]
+    query_tokens = [tokenize(text) for text in texts]
+    max_words = max(len(re.findall(r'\S+', text)) for text in texts)
+
+    for n in range(GOSSIP_KEY_MIN_WORDS, (max_words + 1) // 2 + 1):
+        keys = [get_gossip_text_key(text, n) for text in texts]
+        if len(set(keys)) < len(keys):
+            continue
+        if resolves_to_own_hash(query_tokens, [tokenize(key) for key in keys], hashes):
+            return dict(zip(keys, hashes))
+
+    return text_table
+
+
+def get_skip_reason(row):
+    """Why process_row leaves a row without audio, None for rows that are synthesized."""
+    if "$" in row["cleanedText"] or "<" in row["cleanedText"] or ">" in row["cleanedText"]:
+        return 'invalid chars'
+    # skip progress text (progress text is usually better left unread since its always played before quest completion)
+    if row['source'] == "progress":
+        return 'progress'
+    # only the voices with a sample in SOUND_INPUT_FOLDER are synthesized
+    if not os.path.isfile(get_voice_path(row)):
+        return 'missing voice'
+    return None
+
+
+def get_voice_path(row):
+    """Voice sample cloned for a row's race and gender."""
+    return os.path.join(SOUND_INPUT_FOLDER, f"{row['race']}-{row['gender']}.ogg")
+
+
+def get_sound_file_path(row):
+    """(subfolder, file name) of a row's sound in its locale's sound folder."""
+    file_name = f'{row["quest"]}-{row["source"]}' if row['quest'] else f'{row["templateText_race_gender_hash"]}'
+    if row['player_gender'] is not None:
+        file_name = row['player_gender'] + '-' + file_name
+    file_name = file_name + '.ogg'
+    subfolder = 'quests' if row['quest'] else 'gossip'
+    return subfolder, file_name
+
+
+def process_rows_in_parallel(df, row_proccesing_fn, max_workers=STATIC_MAX_WORKERS):
+    from tts_cli.tts_ai import Converter
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        Converter().process_dataframe(
+            df=df,
+            num_processes=max_workers,
+            executor=executor,
+            row_proccesing_fn=row_proccesing_fn
+        )
+
+
+def tts_locales(processors, df):
+    """
+    Generates the rows of several locales (df['locale'], a processor per locale) in a single pass over one worker
+    pool, so the model and the voice latents are loaded once for all of them. Each row goes to its locale's tree.
+    """
+    for processor in processors.values():
+        processor.create_output_dirs()
+    process_rows_in_parallel(df, lambda row_tuple: processors[row_tuple.locale].process_row(row_tuple))
+    print("Audio finished generating.")
+
+
 class TTSProcessor:
+    def __init__(self, locale=DEFAULT_LOCALE):
+        self.locale = locale
+        self.language = language_code_to_tts_language(locale)
+        self.output_folder = get_output_folder(locale)
+        self.sound_output_folder = get_sound_output_folder(locale)
+        # (filename, changed) for every file written by generate_lookup_tables
+        self.table_write_results = []
+
+    def write_lua_table(self, filename, module_name, table, data):
+        with metrics.stage('lookup_table_write', table=filename):
+            content = DATAMODULE_TABLE_GUARD_CLAUSE + "\n" + \
+                f"{module_name}.{table} = " + lua.encode(sort_lua_table(data)) + "\n"
+
+            # UTF-8 Encoding is important for other languages!
+            changed = write_file_if_changed(
+                os.path.join(self.output_folder, f"{filename}.lua"), content)
+        self.table_write_results.append((f"{filename}.lua", changed))
+
+        print(f"Finished writing {filename}.lua" if changed else f"{filename}.lua is unchanged")
+
     def get_voice_map(self):
         return self.voice_map
 
     def tts(self, text: str, inputName: str, outputName: str, output_subfolder: str, language: str, forceGen: bool = False):
         result = ""
-        outpath = os.path.join(SOUND_OUTPUT_FOLDER, output_subfolder, outputName)
+        outpath = os.path.join(self.sound_output_folder, output_subfolder, outputName)
         
         # input voices to custom race-sex corresponding voice. see tts_row()
         inpath = os.path.join(SOUND_INPUT_FOLDER, inputName)
         
         if os.path.isfile(outpath) and forceGen is not True:
             result = "duplicate generation, skipping"
+            metrics.annotate(status='skipped', reason='exists')
             return
 
-        if os.path.isfile(inpath) is False:
-            inpath = DEFAULT_VOICE
-            return
+        # torch and the TTS model are only loaded once something is synthesized
+        from tts_cli.tts_ai import Converter
+        length = Converter().convert(text=text, input_sound_path=inpath, language=language, output_sound_path=outpath)
+        if length is None:
+            return f"Audio file failed to generate: {outpath}"
 
-        Converter().convert(text=text, input_sound_path=inpath, language=language, output_sound_path=outpath)
+        record_sound_length(self.sound_output_folder, outpath, length, os.path.getsize(outpath))
 
         result = f"Audio file saved successfully!: {outpath}"
 
@@ -113,14 +271,18 @@ class TTSProcessor:
         return male_text, female_text
 
     def preprocess_dataframe(self, df):
+        with metrics.stage('preprocess'):
+            return self.expand_dataframe(df)
+
+    def expand_dataframe(self, df):
         df = df.copy()  # prevent mutation on original df for safety
         df['race'] = df['DisplayRaceID'].map(RACE_DICT)
         df['gender'] = df['DisplaySexID'].map(GENDER_DICT)
 
         df['templateText_race_gender'] = df['original_text'] + \
             df['race'] + df['gender']
-        df['templateText_race_gender_hash'] = df['templateText_race_gender'].apply(
-            get_hash)
+        df['templateText_race_gender_hash'] = shorten_hashes(
+            df['templateText_race_gender'].apply(get_hash), df['templateText_race_gender'])
 
         df['cleanedText'] = df['text'].copy()
 
@@ -157,49 +319,52 @@ class TTSProcessor:
 
         return new_df
 
-    def process_row(self, row_tuple):
+    def process_row(self, row_tuple, force_gen=False):
         row = pd.Series(row_tuple[1:], index=row_tuple._fields[1:])
         custom_message = ""
-        if "$" in row["cleanedText"] or "<" in row["cleanedText"] or ">" in row["cleanedText"]:
+        metrics.annotate(locale=self.locale, source=row['source'], quest=row['quest'], id=row['id'],
+                         voice=f"{row['race']}-{row['gender']}", chars=len(row['cleanedText']))
+        skip_reason = get_skip_reason(row)
+        if skip_reason == 'invalid chars':
             custom_message = f'skipping due to invalid chars: {row["cleanedText"]}'
-        # skip progress text (progress text is usually better left unread since its always played before quest completion)
-        elif row['source'] == "progress":
+        elif skip_reason == 'progress':
             custom_message = f'skipping progress text: {row["quest"]}-{row["source"]}'
+        elif skip_reason == 'missing voice':
+            custom_message = f'skipping, no voice sample for {row["race"]}-{row["gender"]}'
         else:
-            self.tts_row(row)
+            self.tts_row(row, force_gen)
+        if skip_reason is not None:
+            metrics.annotate(status='skipped', reason=skip_reason)
         return custom_message
 
-    def tts_row(self, row):
+    def tts_row(self, row, force_gen=False):
         tts_text = row['cleanedText']
-        file_name = f'{row["quest"]}-{row["source"]}' if row['quest'] else f'{row["templateText_race_gender_hash"]}'
-        if row['player_gender'] is not None:
-            file_name = row['player_gender'] + '-' + file_name
-        file_name = file_name + '.ogg'
-        subfolder = 'quests' if row['quest'] else 'gossip'
-        language = 'fr'
+        subfolder, file_name = get_sound_file_path(row)
+        language = self.language
 
         # source voice from corresponding race-gender
         input_file_name = row['race'] + '-' + row['gender'] + '.ogg'
         output_file_name = file_name
-        
-        self.tts(tts_text, input_file_name, output_file_name, subfolder, language)
+        metrics.annotate(file=f"{subfolder}/{file_name}")
+
+        self.tts(tts_text, input_file_name, output_file_name, subfolder, language, force_gen)
 
     def create_output_dirs(self):
-        create_output_subdirs('')
-        create_output_subdirs('quests')
-        create_output_subdirs('gossip')
-
-    def process_rows_in_parallel(self, df, row_proccesing_fn, max_workers=STATIC_MAX_WORKERS):
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            Converter().process_dataframe(
-                df=df,
-                num_processes=max_workers,
-                executor=executor,
-                row_proccesing_fn=row_proccesing_fn
-            )
+        create_output_subdirs(self.sound_output_folder, '')
+        create_output_subdirs(self.sound_output_folder, 'quests')
+        create_output_subdirs(self.sound_output_folder, 'gossip')
+
+    def compact_gossip_table(self, gossip_table, filename):
+        compact_table = {npc: compact_gossip_text_keys(texts) for npc, texts in gossip_table.items()}
+
+        size_before = len(lua.encode(gossip_table).encode('utf-8'))
+        size_after = len(lua.encode(compact_table).encode('utf-8'))
+        print(f"{filename}.lua: {size_before} bytes with full gossip text keys, {size_after} bytes with compact keys "
+              f"({100 * (size_before - size_after) / max(size_before, 1):.1f}% smaller)")
+
+        return compact_table
 
     def write_gossip_file_lookups_table(self, df, module_name, type, table, filename):
-        output_file = OUTPUT_FOLDER + f"/{filename}.lua"
         gossip_table = {}
 
         accept_df = df[(df['quest'] == '') & (df['type'] == type)]
@@ -214,16 +379,11 @@ class TTSProcessor:
             gossip_table[row['id']
                          ][escapedText] = row['templateText_race_gender_hash']
 
-        with open(output_file, "w", encoding="UTF-8") as f:
-            f.write(DATAMODULE_TABLE_GUARD_CLAUSE + "\n")
-            f.write(f"{module_name}.{table} = ")
-            f.write(lua.encode(gossip_table))
-            f.write("\n")
+        gossip_table = self.compact_gossip_table(gossip_table, filename)
 
-        print(f"Finished writing {filename}.lua")
+        self.write_lua_table(filename, module_name, table, gossip_table)
 
     def write_questlog_npc_lookups_table(self, df, module_name, type, table, filename):
-        output_file = OUTPUT_FOLDER + f"/{filename}.lua"
         questlog_table = {}
 
         accept_df = df[(df['source'] == 'accept') & (df['type'] == type)]
@@ -231,16 +391,9 @@ class TTSProcessor:
         for i, row in tqdm(accept_df.iterrows()):
             questlog_table[int(row['quest'])] = row['id']
 
-        with open(output_file, "w", encoding="UTF-8") as f:
-            f.write(DATAMODULE_TABLE_GUARD_CLAUSE + "\n")
-            f.write(f"{module_name}.{table} = ")
-            f.write(lua.encode(questlog_table))
-            f.write("\n")
-
-        print(f"Finished writing {filename}.lua")
+        self.write_lua_table(filename, module_name, table, questlog_table)
 
     def write_npc_name_lookup_table(self, df, module_name, type, table, filename):
-        output_file = OUTPUT_FOLDER + f"/{filename}.lua"
         npc_name_table = {}
 
         accept_df = df[df['type'] == type]
@@ -248,16 +401,9 @@ class TTSProcessor:
         for i, row in tqdm(accept_df.iterrows()):
             npc_name_table[row['id']] = row['name']
 
-        with open(output_file, "w", encoding="UTF-8") as f:
-            f.write(DATAMODULE_TABLE_GUARD_CLAUSE + "\n")
-            f.write(f"{module_name}.{table} = ")
-            f.write(lua.encode(npc_name_table))
-            f.write("\n")
-
-        print(f"Finished writing {filename}.lua")
+        self.write_lua_table(filename, module_name, table, npc_name_table)
 
     def write_quest_id_lookup(self, df, module_name):
-        output_file = OUTPUT_FOLDER + "/quest_id_lookups.lua"
         quest_id_table = {}
 
         quest_df = df[df['quest'] != '']
@@ -295,15 +441,9 @@ class TTSProcessor:
 
         pruned_quest_id_table = prune_quest_id_table(quest_id_table)
 
-        # UTF-8 Encoding is important for other languages!
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(DATAMODULE_TABLE_GUARD_CLAUSE + "\n")
-            f.write(f"{module_name}.QuestIDLookup = ")
-            f.write(lua.encode(pruned_quest_id_table))
-            f.write("\n")
+        self.write_lua_table("quest_id_lookups", module_name, "QuestIDLookup", pruned_quest_id_table)
 
     def write_npc_name_gossip_file_lookups_table(self, df, module_name, type, table, filename):
-        output_file = OUTPUT_FOLDER + f"/{filename}.lua"
         gossip_table = {}
 
         accept_df = df[(df['quest'] == '') & (df['type'] == type)]
@@ -321,21 +461,18 @@ class TTSProcessor:
 
             gossip_table[escaped_npc_name][escapedText] = row['templateText_race_gender_hash']
 
-        with open(output_file, "w", encoding="UTF-8") as f:
-            f.write(DATAMODULE_TABLE_GUARD_CLAUSE + "\n")
-            f.write(f"{module_name}.{table} = ")
-            f.write(lua.encode(gossip_table))
-            f.write("\n")
+        gossip_table = self.compact_gossip_table(gossip_table, filename)
 
-        print(f"Finished writing {filename}.lua")
+        self.write_lua_table(filename, module_name, table, gossip_table)
 
     def tts_dataframe(self, df):
-        self.create_output_dirs()
-        self.process_rows_in_parallel(
-            df, self.process_row, max_workers=STATIC_MAX_WORKERS)
-        print("Audio finished generating.")
+        tts_locales({self.locale: self}, df.assign(locale=self.locale))
 
     def generate_lookup_tables(self, df):
+        with metrics.stage('lookup_tables'):
+            self.write_lookup_tables(df)
+
+    def write_lookup_tables(self, df):
         self.create_output_dirs()
         self.write_gossip_file_lookups_table(
             df, MODULE_NAME, 'creature', 'GossipLookupByNPCID', 'npc_gossip_file_lookups')
@@ -343,7 +480,6 @@ class TTSProcessor:
             df, MODULE_NAME, 'gameobject', 'GossipLookupByObjectID', 'object_gossip_file_lookups')
 
         self.write_quest_id_lookup(df, MODULE_NAME)
-        print("Finished writing quest_id_lookups.lua")
 
         self.write_npc_name_gossip_file_lookups_table(
             df, MODULE_NAME, 'creature', 'GossipLookupByNPCName', 'npc_name_gossip_file_lookups')
@@ -364,12 +500,18 @@ class TTSProcessor:
         self.write_npc_name_lookup_table(
             df, MODULE_NAME, 'item', 'ItemNameLookupByItemID', 'item_name_lookups')
 
-        write_sound_length_table_lua(
-            MODULE_NAME, SOUND_OUTPUT_FOLDER, OUTPUT_FOLDER)
-        print("Updated sound_length_table.lua")
+        changed = write_sound_length_table_lua(
+            MODULE_NAME, self.sound_output_folder, self.output_folder)
+        self.table_write_results.append(("sound_length_table.lua", changed))
+        print("Updated sound_length_table.lua" if changed else "sound_length_table.lua is unchanged")
+
+        changed_files = [name for name, changed in self.table_write_results if changed]
+        print(f"{len(changed_files)} of {len(self.table_write_results)} lookup tables changed" +
+              (": " + ", ".join(changed_files) if changed_files else ""))
 
 
 def run():
+    import torch.multiprocessing as mp
     mp.freeze_support()
     print('loop')
 
@@ -1,4 +1,7 @@
 import re
+import os
+import hashlib
+import tempfile
 
 def get_first_n_words(text, n):
     words = re.findall(r'\S+', text)
@@ -37,3 +40,64 @@ def language_code_to_language_number(local_code: str) -> int:
             return 8
         case _:
             raise Exception("Unsupported local code!")
+
+
+def language_code_to_tts_language(local_code: str) -> str:
+    """XTTS language of a client locale"""
+    match local_code:
+        case "enUS" | "enGB":
+            return "en"
+        case "koKR":
+            return "ko"
+        case "frFR":
+            return "fr"
+        case "deDE":
+            return "de"
+        case "zhCN" | "zhTW":    # XTTS only speaks simplified chinese
+            return "zh-cn"
+        case "esES" | "esMX":
+            return "es"
+        case "ruRU":
+            return "ru"
+        case _:
+            raise Exception("Unsupported local code!")
+
+
+def sort_lua_table(table):
+    """Returns a copy of a nested dict with keys sorted at every level, for deterministic lua.encode output."""
+    if not isinstance(table, dict):
+        return table
+    return {key: sort_lua_table(table[key]) for key in sorted(table)}
+
+
+def write_file_if_changed(path: str, content: str, encoding: str = "utf-8") -> bool:
+    """
+    Atomically replaces the file at path with content, unless it already holds exactly that content.
+    The data is written to a temporary file next to the target and renamed over it, so an interrupted run
+    never leaves a truncated file behind. Returns whether the file changed.
+    """
+    data = content.encode(encoding)
+
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                return False
+        mode = os.stat(path).st_mode & 0o777
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, mode)  # mkstemp creates the file readable by its owner only
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    return True
@@ -1,21 +1,32 @@
+import os
+import re
+import time
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pymysql
 import pandas as pd
-from tts_cli.sql_queries import make_connection
+from tts_cli.env_vars import MYSQL_DATABASE, DB_BACKEND
+from tts_cli.sql_queries import connection_pool, query_dataframe
+from tts_cli.sql_splitter import get_query_tables
+from tts_cli.sqlite_backend import get_sqlite_path
 from tts_cli.consts import RACE_DICT
 
-def write_model_data():
-    db = make_connection()
-    query = '''
-    with data112 as (
-        with normalized_models(entry, display_id, name) as (
-            select entry, display_id1, name from mangos.creature_template where display_id1
-            union distinct
-            select entry, display_id2, name from mangos.creature_template where display_id2
-            union distinct
-            select entry, display_id3, name from mangos.creature_template where display_id3
-            union distinct
-            select entry, display_id4, name from mangos.creature_template where display_id4
+# creature_template keeps up to four display ids per creature, they are unpivoted in a single scan by a cross join with
+# the slot numbers instead of four scans unioned together
+MODEL_DATA_QUERIES = {
+    'mangos': '''
+        with normalized_models as (
+            select entry, display_id, name from (
+                select entry, name, case slots.n when 1 then display_id1 when 2 then display_id2
+                                                 when 3 then display_id3 else display_id4 end as display_id
+                from mangos.creature_template
+                cross join (select 1 as n union all select 2 union all select 3 union all select 4) slots
+            ) unpivoted
+            where display_id
         )
-        select distinct modelname, entry, name from (
+        select distinct entry, cmd.ModelName as modelname, name from (
             select id from mangos.creature_questrelation
             union distinct
             select id from mangos.creature_involvedrelation
@@ -25,18 +36,18 @@ def write_model_data():
         left join normalized_models nm on nm.entry=sources.id
         left join mangos.db_CreatureDisplayInfo cdi on cdi.ID=nm.display_id
         left join mangos.db_CreatureModelData cmd on cmd.ID=cdi.ModelID -- 112_CreatureModelData.sql
-    ),
-    data335 as (
-        with normalized_models(entry, display_id, name) as (
-            select entry, modelid1, Name from mangos_wrath.creature_template where modelid1
-            union distinct
-            select entry, modelid2, Name from mangos_wrath.creature_template where modelid2
-            union distinct
-            select entry, modelid3, Name from mangos_wrath.creature_template where modelid3
-            union distinct
-            select entry, modelid4, Name from mangos_wrath.creature_template where modelid4
+    ''',
+    'mangos_wrath': '''
+        with normalized_models as (
+            select entry, display_id, name from (
+                select entry, Name as name, case slots.n when 1 then modelid1 when 2 then modelid2
+                                                         when 3 then modelid3 else modelid4 end as display_id
+                from mangos_wrath.creature_template
+                cross join (select 1 as n union all select 2 union all select 3 union all select 4) slots
+            ) unpivoted
+            where display_id
         )
-        select distinct modelname, entry, name  from (
+        select distinct entry, cmd.ModelName as modelname, name from (
             select id from mangos_wrath.creature_questrelation
             union distinct
             select id from mangos_wrath.creature_involvedrelation
@@ -46,47 +57,198 @@ def write_model_data():
         left join normalized_models nm on nm.entry=sources.id
         left join mangos_wrath.db_CreatureDisplayInfo cdi on cdi.ID=nm.display_id -- 335_CreatureDisplayInfo.sql
         left join mangos_wrath.db_CreatureModelData cmd on cmd.ID=cdi.ModelID -- 335_CreatureModelData.sql
-    )
-    select entry, modelname, name from (
-        select * from data112
-        union distinct
-        select * from data335
-    ) combined
-    order by entry
-    '''
-    with db.cursor() as cursor:
-        cursor.execute(query)
-        data = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-
-    db.close()
-    df = pd.DataFrame(data, columns=columns)
-
-
-    def extract_info(modelname):
-        race_id = -1
-        gender = -1
-        if not modelname:
-            return race_id, gender, -1
-        
-        unique_voice_name = modelname.split("\\")[-1].split(".")[0]
-
-        for key, value in RACE_DICT.items():
-            if value.lower() in modelname.lower():
-                race_id = key
-                break
-
-        if "female" in modelname.lower():
-            gender = 1
-        elif "male" in modelname.lower():
-            gender = 0
-
-        return race_id, gender, unique_voice_name
+    ''',
+}
+MODEL_DATA_CACHE_DIR = "assets/sql/cache/model_data"
+# init-db --expansion importing each schema of MODEL_DATA_QUERIES
+SCHEMA_EXPANSIONS = {'mangos': 'vanilla', 'mangos_wrath': 'wotlk'}
+
+
+# every race name as an alternative, longest first so the longest name wins at a given position; the lookahead makes
+# str.extractall report a match at every position, so a longer name starting later (thinhuman) is still seen
+RACE_PATTERN = re.compile(
+    '(?=(' + '|'.join(re.escape(name) for name in sorted(set(RACE_DICT.values()), key=len, reverse=True)) + '))')
+# duplicated race names (human, pandaren) resolve to their first id, as the old loop over RACE_DICT did
+RACE_IDS_BY_NAME = {}
+for race_id, race_name in RACE_DICT.items():
+    RACE_IDS_BY_NAME.setdefault(race_name, race_id)
+
+# classified on their own by --compare, the database rarely holds them all and some only break when alone
+COMPARE_EDGE_CASES = [
+    'Creature\\Wolf\\Wolf.mdx',  # no race name
+    '',
+    None,
+    'Character\\Human\\Female\\HumanFemale.mdx',
+    'Creature\\ThinHuman\\ThinHuman.mdx',  # a longer race name starting after a shorter one
+    'Character\\BloodElf\\Male\\BloodElfMale.mdx',
+]
+
+
+def extract_info(modelname):
+    """Per-row classification used before classify_model_names, kept as the reference for --compare."""
+    race_id = -1
+    gender = -1
+    if not modelname:
+        return race_id, gender, -1
+
+    unique_voice_name = modelname.split("\\")[-1].split(".")[0]
+
+    for key, value in RACE_DICT.items():
+        if value.lower() in modelname.lower():
+            race_id = key
+            break
+
+    if "female" in modelname.lower():
+        gender = 1
+    elif "male" in modelname.lower():
+        gender = 0
+
+    return race_id, gender, unique_voice_name
+
+
+def classify_model_names(modelnames):
+    """
+    Returns race_id, gender and unique_voice_name for a whole Series of model paths with vectorized string operations.
+    The race is the longest race name found anywhere in the path, leftmost on equal length.
+    """
+    # many creatures share a model, each distinct path is classified once
+    codes, distinct = pd.factorize(modelnames.fillna(''))
+    classified = classify_distinct_model_names(pd.Series(distinct, dtype=object))
+    return classified.iloc[codes].set_index(modelnames.index)
+
+
+def classify_distinct_model_names(modelnames):
+    lowered = modelnames.fillna('').str.lower()
+    missing = lowered == ''
+
+    # one row per (model, position) where a race name starts
+    matches = lowered.reset_index(drop=True).str.extractall(RACE_PATTERN)[0].rename('race') \
+        .rename_axis(['row', 'position']).reset_index()
+    best = matches.assign(length=matches['race'].str.len()) \
+        .sort_values(['length', 'position'], ascending=[False, True], kind='stable').drop_duplicates(subset='row')
+    race_id = np.full(len(modelnames), -1)
+    # the row level of an empty extractall result (no race name anywhere) is not an integer dtype
+    race_id[best['row'].to_numpy(dtype=np.intp)] = best['race'].map(RACE_IDS_BY_NAME).to_numpy()
+    race_id = pd.Series(race_id, index=modelnames.index)
+
+    gender = pd.Series(np.select([lowered.str.contains('female', regex=False),
+                                  lowered.str.contains('male', regex=False)], [1, 0], -1), index=modelnames.index)
+
+    unique_voice_name = modelnames.fillna('').str.rsplit('\\', n=1).str[-1].str.split('.', n=1).str[0].astype(object)
+    unique_voice_name[missing] = -1
+
+    return pd.DataFrame({'race_id': race_id, 'gender': gender, 'unique_voice_name': unique_voice_name})
+
+
+def compare_classifiers(df):
+    start = time.perf_counter()
+    legacy = df['modelname'].apply(lambda x: pd.Series(extract_info(x)))
+    legacy.columns = ['race_id', 'gender', 'unique_voice_name']
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    current = classify_model_names(df['modelname'])
+    current_seconds = time.perf_counter() - start
+
+    print(f"{len(df)} model names: per-row apply {legacy_seconds * 1000:.1f}ms, "
+          f"vectorized {current_seconds * 1000:.1f}ms ({legacy_seconds / max(current_seconds, 1e-9):.1f}x)")
+
+    for column in ['gender', 'unique_voice_name']:
+        differences = (legacy[column].astype(str) != current[column].astype(str)).sum()
+        print(f"{column}: {differences} rows differ")
+
+    changed = legacy['race_id'] != current['race_id']
+    print(f"race_id: {changed.sum()} rows differ")
+    if changed.any():
+        table = pd.DataFrame({
+            'old': legacy.loc[changed, 'race_id'].map(RACE_DICT),
+            'new': current.loc[changed, 'race_id'].map(RACE_DICT),
+            'example': df.loc[changed, 'modelname'],
+        }).groupby(['old', 'new'])['example'].agg(['count', 'first']).sort_values('count', ascending=False)
+        print(table.to_string())
+
+    rows = []
+    for modelname in COMPARE_EDGE_CASES:
+        try:
+            current = tuple(classify_model_names(pd.Series([modelname], dtype=object)).iloc[0])
+        except Exception as e:
+            current = f"{type(e).__name__}: {e}"
+        legacy = extract_info(modelname)
+        rows.append({'modelname': modelname, 'old': legacy, 'new': current,
+                     'same': [str(value) for value in legacy] == [str(value) for value in current]
+                     if isinstance(current, tuple) else False})
+    print("Edge cases, each classified alone:")
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+def get_schema_fingerprint(db, schema, query):
+    """Changes whenever the query or one of the tables it reads in schema changes."""
+    tables = sorted(get_query_tables(query, MYSQL_DATABASE).get(schema, set()))
+    fingerprint = hashlib.sha256(query.encode())
+    if DB_BACKEND == 'sqlite':
+        path = get_sqlite_path(schema)
+        if not os.path.isfile(path):
+            raise Exception(f"{path} does not exist, import it first with "
+                            f"python cli-main.py init-db --expansion {SCHEMA_EXPANSIONS[schema]}")
+        # every import or restore rewrites the schema's file
+        stat = os.stat(path)
+        fingerprint.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    else:
+        # the table metadata changes with every import (tables are dropped and re-created) and every write, without
+        # the full scan CHECKSUM TABLE does on InnoDB tables; a spurious change only costs one re-query
+        with db.cursor() as cursor:
+            try:
+                # MySQL 8 otherwise serves these columns from a cache refreshed once a day
+                cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+            except pymysql.Error:
+                pass  # MariaDB and MySQL 5.7 always read them live
+            cursor.execute(
+                "SELECT LOWER(TABLE_NAME), CREATE_TIME, UPDATE_TIME, TABLE_ROWS, DATA_LENGTH "
+                "FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s AND LOWER(TABLE_NAME) IN "
+                f"({', '.join(['%s'] * len(tables))}) ORDER BY 1", (schema, *tables))
+            for row in cursor.fetchall():
+                fingerprint.update(":".join(map(str, row)).encode())
+    return fingerprint.hexdigest()
+
+
+def query_model_data(schema):
+    """Runs the schema's half of the model extraction, or reads it from the cache if the schema did not change."""
+    query = MODEL_DATA_QUERIES[schema]
+    data_path = os.path.join(MODEL_DATA_CACHE_DIR, f"{schema}.parquet")
+    meta_path = os.path.join(MODEL_DATA_CACHE_DIR, f"{schema}.json")
+    start = time.perf_counter()
+
+    with connection_pool.connection() as db:
+        fingerprint = get_schema_fingerprint(db, schema, query)
+        if os.path.isfile(meta_path) and os.path.isfile(data_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                if json.load(f).get('fingerprint') == fingerprint:
+                    df = pd.read_parquet(data_path)
+                    print(f"{schema}: {len(df)} rows from cache in {time.perf_counter() - start:.2f}s")
+                    return df
+        df = query_dataframe(db, query)
+
+    os.makedirs(MODEL_DATA_CACHE_DIR, exist_ok=True)
+    df.to_parquet(data_path + ".part", index=False)
+    os.replace(data_path + ".part", data_path)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({'fingerprint': fingerprint}, f, indent=2)
+    print(f"{schema}: {len(df)} rows queried in {time.perf_counter() - start:.2f}s")
+    return df
+
+
+def write_model_data(compare=False):
+    # each expansion is extracted on its own connection, the union of both halves happens here
+    with ThreadPoolExecutor(max_workers=len(MODEL_DATA_QUERIES)) as executor:
+        halves = list(executor.map(query_model_data, MODEL_DATA_QUERIES))
+    df = pd.concat(halves, ignore_index=True).drop_duplicates() \
+        .sort_values(['entry', 'modelname'], kind='stable', na_position='first').reset_index(drop=True)
 
+    if compare:
+        compare_classifiers(df)
 
     # Create new columns 'race_id', 'gender', and 'unique_voice_name'
-    df[['race_id', 'gender', 'unique_voice_name']] = df['modelname'].apply(
-        lambda x: pd.Series(extract_info(x)))
+    df[['race_id', 'gender', 'unique_voice_name']] = classify_model_names(df['modelname'])
 
     # Write the updated DataFrame to a new CSV file
     df.to_csv("generated/warcraft-display-metadata.csv", index=False)
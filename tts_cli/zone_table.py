@@ -0,0 +1,101 @@
+import os
+import json
+import difflib
+from tts_cli.sql_queries import query_dataframe_for_quest_giver_positions, query_dataframe_for_area_names
+
+ZONE_TABLE_PATH = "assets/zone_bounds.json"
+# quest givers further than this many interquartile ranges outside the middle half of a zone's spawns (e.g. ending its
+# quests from a capital city) are left out of its bounds
+ZONE_OUTLIER_IQR_FACTOR = 1.5
+# yards added on every side so NPCs standing next to the outermost quest givers are kept
+ZONE_BOUNDS_MARGIN = 50.0
+
+
+def get_bounds(positions):
+    # a zone's quest givers may sit on several maps (instances), the map holding most of them wins
+    map_id = int(positions['map'].mode().iloc[0])
+    positions = positions[positions['map'] == map_id]
+    inliers = True
+    for column in ['position_x', 'position_y']:
+        q1, q3 = positions[column].quantile([0.25, 0.75])
+        fence = ZONE_OUTLIER_IQR_FACTOR * (q3 - q1)
+        inliers &= positions[column].between(q1 - fence, q3 + fence)
+    positions = positions[inliers]
+    x_min, x_max = positions['position_x'].min(), positions['position_x'].max()
+    y_min, y_max = positions['position_y'].min(), positions['position_y'].max()
+    return {
+        'map': map_id,
+        'x': [round(float(x_min) - ZONE_BOUNDS_MARGIN, 2), round(float(x_max) + ZONE_BOUNDS_MARGIN, 2)],
+        'y': [round(float(y_min) - ZONE_BOUNDS_MARGIN, 2), round(float(y_max) + ZONE_BOUNDS_MARGIN, 2)],
+        'spawns': len(positions),
+    }
+
+
+def write_zone_table(output_path=ZONE_TABLE_PATH):
+    """
+    Derives the game-coordinate bounds of every zone and area from the spawn positions of the creatures giving its
+    quests (quest_template.ZoneOrSort), named after area_template, so zones can be picked without the map GUI.
+    Areas without quests of their own get the bounds of the zone they belong to.
+    """
+    positions = query_dataframe_for_quest_giver_positions()
+    areas = query_dataframe_for_area_names()
+    areas['zone_id'] = areas['zone_id'].where(areas['zone_id'] != 0, areas['area_id'])
+
+    # quests of a subarea also count towards its zone
+    positions = positions.merge(areas[['area_id', 'zone_id']], on='area_id', how='left')
+    positions['zone_id'] = positions['zone_id'].fillna(positions['area_id']).astype(int)
+
+    area_bounds = {area_id: get_bounds(group) for area_id, group in positions.groupby('area_id')}
+    zone_bounds = {zone_id: get_bounds(group) for zone_id, group in positions.groupby('zone_id')}
+
+    table = {}
+    for area in areas.itertuples():
+        if area.area_id == area.zone_id and area.zone_id in zone_bounds:
+            bounds = zone_bounds[area.zone_id]
+        elif area.area_id in area_bounds:
+            bounds = area_bounds[area.area_id]
+        elif area.zone_id in zone_bounds:
+            bounds = zone_bounds[area.zone_id]
+        else:
+            continue
+        # area names are not unique, keep the one backed by the most quest givers
+        if area.name in table and table[area.name]['spawns'] >= bounds['spawns']:
+            continue
+        table[area.name] = {'area_id': int(area.area_id), 'zone_id': int(area.zone_id), **bounds}
+
+    table = dict(sorted(table.items()))
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(table, f, indent=2, ensure_ascii=False)
+    print(f"Zone table with {len(table)} zones and areas written to {output_path}")
+
+
+def load_zone_table(path=ZONE_TABLE_PATH):
+    if not os.path.isfile(path):
+        raise Exception(f"Zone table {path} not found, run gen_zone_table first")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_zone(name, path=ZONE_TABLE_PATH):
+    """Returns (x_range, y_range, map_id) of a zone or area by name, ignoring case."""
+    table = load_zone_table(path)
+    by_lower_name = {zone_name.lower(): zone_name for zone_name in table}
+    zone_name = by_lower_name.get(name.strip().lower())
+    if zone_name is None:
+        suggestions = [lower_name for lower_name in by_lower_name if name.strip().lower() in lower_name][:3] or \
+            difflib.get_close_matches(name.strip().lower(), by_lower_name, n=3)
+        hint = f", did you mean {', '.join(by_lower_name[s] for s in suggestions)}?" if suggestions else ""
+        raise Exception(f"Unknown zone {name}{hint}")
+    zone = table[zone_name]
+    return tuple(zone['x']), tuple(zone['y']), zone['map']
+
+
+def parse_bbox(bbox):
+    """Parses "map,x_min,x_max,y_min,y_max" in game coordinates into (x_range, y_range, map_id)."""
+    parts = bbox.split(",")
+    if len(parts) != 5:
+        raise Exception(f"Invalid bounding box {bbox}, expected map,x_min,x_max,y_min,y_max")
+    map_id = int(parts[0])
+    x_min, x_max, y_min, y_max = map(float, parts[1:])
+    return (min(x_min, x_max), max(x_min, x_max)), (min(y_min, y_max), max(y_min, y_max)), map_id